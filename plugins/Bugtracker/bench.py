@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- Encoding: utf-8 -*-
+###
+# Copyright (c) 2005-2007 Dennis Kaarsemaker
+# Copyright (c) 2008-2010 Terence Simpson
+# Copyright (c) 2017-     Krytarik Raido
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of version 2 of the GNU General Public License as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+###
+
+"""Benchmark the Bugtracker plugin without touching the network.
+
+Bug lookups of every backend are timed against local stub servers, which
+answer like the real trackers do after a configurable latency and with a
+configurable amount of padding in each bug. Channel traffic, either from
+a log file or made up, is then replayed through the snarfers.
+
+    python3 plugins/Bugtracker/bench.py [--latency 20] [--payload 2000]
+
+The stub servers run in a separate process, so that only the plugin's
+own work shows up in the timings and allocations.
+"""
+
+import os, re, sys, json, time, atexit, random, shutil, argparse, tempfile, tracemalloc
+import logging, multiprocessing
+from concurrent import futures
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+backends = ('bugzilla', 'launchpad', 'debbugs', 'github', 'gitlab', 'gitea', 'sourceforge', 'mantis', 'trac')
+
+# Where each backend is served from on the stub server, as the tracker URL
+# it derives its API URLs from
+tracker_paths = {
+    'bugzilla':    '/bugzilla',
+    'launchpad':   '/launchpad',
+    'debbugs':     '/debbugs',
+    'github':      '/github/github.com/owner/repo/issues',
+    'gitlab':      '/gitlab/owner/repo/issues',
+    'gitea':       '/owner/repo/issues',
+    'sourceforge': '/sourceforge.net/p/project/bugs',
+    'mantis':      '/mantis',
+    'trac':        '/trac/ticket',
+}
+
+soap_response = '''<?xml version="1.0" encoding="UTF-8"?><soap:Envelope \
+soap:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/" \
+xmlns:soapenc="http://schemas.xmlsoap.org/soap/encoding/" xmlns:xsd="http://www.w3.org/2001/XMLSchema" \
+xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">\
+<soap:Body><get_statusResponse xmlns="Debbugs/SOAP"><s-gensym3 xsi:type="apachens:Map">%s</s-gensym3>\
+</get_statusResponse></soap:Body></soap:Envelope>'''
+
+soap_item = '''<item><key xsi:type="xsd:int">%d</key><value>\
+<fixed_versions soapenc:arrayType="xsd:anyType[0]" xsi:type="soapenc:Array"/>\
+<package xsi:type="xsd:string">package%d</package><subject xsi:type="xsd:string">Bug %d</subject>\
+<severity xsi:type="xsd:string">normal</severity><originator xsi:type="xsd:string">%s</originator>\
+</value></item>'''
+
+launchpad_text = '''bug: %d
+title: Bug %d
+duplicate-of:
+description: %s
+
+task: package%d (Ubuntu)
+status: Confirmed
+importance: High
+assignee: Some One (someone)
+
+task: package%d (Debian)
+status: New
+importance: Undecided
+assignee:
+
+Content-Type: text/plain
+
+%s
+'''
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers like each of the trackers would"""
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, don't let Nagle's algorithm
+    # add the client's delayed ACK to every response
+    disable_nagle_algorithm = True
+    latency = 0.0
+    padding = ''
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, body, ctype='application/json'):
+        if not isinstance(body, bytes):
+            body = (body if isinstance(body, str) else json.dumps(body)).encode('utf-8')
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def not_found(self):
+        time.sleep(self.latency)
+        self.send_response(404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        request = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        if not self.path.startswith('/debbugs/'):
+            return self.not_found()
+        ids = [int(x) for x in re.findall(r'<(?:item|bugs)[^>]*>(\d+)</', request)]
+        self.reply(soap_response % ''.join(soap_item % (id, id, id, self.padding) for id in ids), 'text/xml')
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        path = url.path
+        pad = self.padding
+        m = re.search(r'/(\d+)(?:\.json|/\+text)?/?$', path)
+        id = int(m.group(1)) if m else 0
+        if path == '/bugzilla/rest/bug':
+            ids = [int(x) for x in parse_qs(url.query)['id'][0].split(',')]
+            self.reply({'bugs': [self.bugzilla(id) for id in ids], 'faults': []})
+        elif path.startswith('/bugzilla/rest/bug/'):
+            self.reply({'bugs': [self.bugzilla(id)]})
+        elif path.startswith('/launchpad/bugs/'):
+            self.reply(launchpad_text % (id, id, pad, id, id, pad), 'text/plain')
+        elif path.startswith('/github/'):
+            self.reply({'title': 'Bug %d' % id, 'state': 'open', 'assignee': {'login': 'someone'},
+                        'html_url': 'https://github.com/owner/repo/issues/%d' % id, 'body': pad})
+        elif path.startswith('/gitlab/'):
+            self.reply({'title': 'Bug %d' % id, 'state': 'opened', 'assignees': [{'name': 'Some One'}],
+                        'description': pad})
+        elif path.startswith('/api/v1/repos/'):
+            self.reply({'title': 'Bug %d' % id, 'state': 'open', 'assignee': {'username': 'someone'}, 'body': pad})
+        elif path.startswith('/sourceforge.net/rest/'):
+            self.reply({'ticket': {'summary': 'Bug %d' % id, 'status': 'open-accepted', 'assigned_to': 'someone',
+                                   'labels': ['label'], 'custom_fields': {'_priority': '5'}, 'description': pad}})
+        elif path.startswith('/mantis/api/rest/issues/'):
+            self.reply({'issues': [{'project': {'name': 'project'}, 'summary': 'Bug %d' % id,
+                                    'severity': {'name': 'minor'}, 'resolution': {'name': 'open'},
+                                    'description': pad}]})
+        elif path.startswith('/trac/ticket/'):
+            self.reply('id\tsummary\tstatus\tcomponent\tpriority\towner\tdescription\r\n'
+                       '%d\tBug %d\tnew\tcomponent\tmajor\tsomeone\t%s\r\n' % (id, id, pad), 'text/plain')
+        else:
+            self.not_found()
+
+    @classmethod
+    def bugzilla(cls, id):
+        return {'id': id, 'product': 'Product', 'summary': 'Bug %d' % id, 'severity': 'normal',
+                'status': 'CONFIRMED', 'resolution': '', 'assigned_to': 'someone@example.org',
+                'assigned_to_detail': {'real_name': 'Some One'}, 'whiteboard': cls.padding}
+
+def serve(latency, payload, ready):
+    StubHandler.latency = latency
+    StubHandler.padding = 'x' * payload
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    ready.put(server.server_port)
+    server.serve_forever()
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+def ms(seconds):
+    return '%8.2f' % (seconds * 1000)
+
+def bench_backend(plugin, tracker, args, first_id):
+    """Time lookups of one backend: one at a time for the latency
+    percentiles, all at once for the throughput, and a few under
+    tracemalloc for the allocations"""
+    ids = iter(range(first_id, first_id + 10 * args.lookups + 100))
+    for i in range(3): # Warm up connections
+        tracker.get_bug(next(ids))
+
+    latencies = []
+    for i in range(args.lookups):
+        start = time.perf_counter()
+        tracker.get_bug(next(ids))
+        latencies.append(time.perf_counter() - start)
+
+    batch = [next(ids) for i in range(args.lookups)]
+    with futures.ThreadPoolExecutor(args.concurrency) as pool:
+        start = time.perf_counter()
+        list(pool.map(tracker.get_bug, batch))
+        elapsed = time.perf_counter() - start
+
+    peaks = []
+    tracemalloc.start()
+    for i in range(min(args.lookups, 20)):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        tracker.get_bug(next(ids))
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+
+    return (latencies, args.lookups / elapsed, sum(peaks) / len(peaks))
+
+chatter = ("hi all", "anyone around?", "try rebooting", "works for me on 22.04", "see the wiki page",
+           "it's fixed in git", "thanks!", "the build failed again", "ping me later", "lol",
+           "version 2.4.1 has that", "meeting at 14:00 UTC", "https://example.org/some/page")
+mentions = ("bug %d", "launchpad bug %d", "debian bug %d and %d", "lp #%d", "see bugs.debian.org/%d",
+            "https://bugs.launchpad.net/ubuntu/+bug/%d", "github.com/owner/repo/issues/%d",
+            "CVE-2021-%d", "OOPS-%dabc")
+
+def make_traffic(count, ratio):
+    rng = random.Random(42)
+    lines = []
+    for i in range(count):
+        if rng.random() < ratio:
+            text = rng.choice(mentions)
+            lines.append(text % tuple(rng.randint(1000, 2000000) for i in range(text.count('%d'))))
+        else:
+            lines.append(rng.choice(chatter))
+    return lines
+
+def load_traffic(filename):
+    """Messages from an IRC log, dropping timestamps and nicks of the
+    usual log formats"""
+    lines = []
+    with open(filename, encoding='utf-8', errors='replace') as fd:
+        for line in fd:
+            line = re.sub(r'^(\[?[\d:\-T ]+\]?\s+)?(<[^>]+>|\S+:)\s+', '', line.rstrip('\n'))
+            if line:
+                lines.append(line)
+    return lines
+
+def bench_snarfers(plugin, lines):
+    """Replay messages through the combined snarfer regexp, prefiltered
+    like Bugtracker.doPrivmsg does, and through each snarfer's own regexp
+    the way they were matched before being combined"""
+    Bugtracker = plugin.Bugtracker
+    flags = Bugtracker.flags
+    combined = re.compile(Bugtracker.snarfer.__doc__, flags)
+    separate = [re.compile(getattr(Bugtracker, name).__doc__, flags) for name in Bugtracker.snarfers]
+
+    def combined_pass():
+        found = 0
+        for line in lines:
+            if plugin.snarfcheck.search(line):
+                for m in combined.finditer(line):
+                    found += 1
+        return found
+
+    def separate_pass():
+        found = 0
+        for line in lines:
+            for r in separate:
+                for m in r.finditer(line):
+                    found += 1
+        return found
+
+    results = []
+    for (name, run) in (('combined', combined_pass), ('separate', separate_pass)):
+        start = time.perf_counter()
+        found = run()
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results.append((name, found, len(lines) / elapsed, peak))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--latency', type=float, default=20.0, help='stub server latency in ms (default: 20)')
+    parser.add_argument('--payload', type=int, default=2000, help='bytes of padding in each bug (default: 2000)')
+    parser.add_argument('--lookups', type=int, default=50, help='lookups per backend (default: 50)')
+    parser.add_argument('--concurrency', type=int, default=5, help='concurrent lookups for throughput (default: 5)')
+    parser.add_argument('--backends', default=','.join(backends), help='comma separated backends to run')
+    parser.add_argument('--traffic', help='IRC log to replay through the snarfers, instead of made up messages')
+    parser.add_argument('--messages', type=int, default=100000, help='made up messages to replay (default: 100000)')
+    parser.add_argument('--mentions', type=float, default=0.05, help='share of made up messages mentioning bugs')
+    args = parser.parse_args()
+
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(args.latency / 1000.0, args.payload, ready), daemon=True)
+    server.start()
+    base = 'http://127.0.0.1:%d' % ready.get(timeout=10)
+
+    # Supybot keeps its configuration and data relative to the current
+    # directory, so give it a scratch one. It writes them and logs until
+    # it has shut down at exit, so stay in it and only remove it after.
+    plugins = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if args.traffic:
+        args.traffic = os.path.abspath(args.traffic)
+    scratch = tempfile.mkdtemp(prefix='bugtracker-bench-')
+    atexit.register(shutil.rmtree, scratch, True)
+    os.chdir(scratch)
+    try:
+        os.mkdir('conf')
+        for name in ('users.conf', 'channels.conf', 'networks.conf', 'ignores.conf'):
+            open(os.path.join('conf', name), 'w').close()
+        sys.path.insert(0, plugins)
+        import supybot.log
+        supybot.log._stdoutHandler.setLevel(logging.WARNING)
+        import supybot.conf as conf
+        from Bugtracker import plugin
+        for name in ('cacheTTL', 'cacheNotFoundTTL', 'cacheErrorTTL', 'validatorCacheSize'):
+            conf.supybot.plugins.Bugtracker.get(name).setValue(0)
+        conf.supybot.plugins.Bugtracker.connectionsPerHost.setValue(max(4, args.concurrency))
+        plugin.httppool.pool.maxPerHost = max(4, args.concurrency)
+        plugin.launchpad.missing = True # Always the +text interface, launchpadlib would go online
+
+        print('Stub latency %.1f ms, payload %d bytes, %d lookups per backend, %d concurrent'
+              % (args.latency, args.payload, args.lookups, args.concurrency))
+        print('%-12s %8s %8s %8s %8s %10s %10s' % ('backend', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms',
+                                                   'lookups/s', 'peak KiB'))
+        for (i, name) in enumerate(args.backends.split(',')):
+            tracker = plugin.defined_bugtrackers[name](name, base + tracker_paths[name], name, name)
+            (latencies, throughput, peak) = bench_backend(plugin, tracker, args, 1000 + i * 100000)
+            print('%-12s %s %s %s %s %10.1f %10.1f' % (name, ms(percentile(latencies, 50)),
+                  ms(percentile(latencies, 90)), ms(percentile(latencies, 99)), ms(max(latencies)),
+                  throughput, peak / 1024.0))
+
+        if args.traffic:
+            lines = load_traffic(args.traffic)
+        else:
+            lines = make_traffic(args.messages, args.mentions)
+        print('')
+        print('Snarfers over %d messages' % len(lines))
+        print('%-12s %8s %12s %10s' % ('regexps', 'matches', 'messages/s', 'peak KiB'))
+        for (name, found, rate, peak) in bench_snarfers(plugin, lines):
+            print('%-12s %8d %12.0f %10.1f' % (name, found, rate, peak / 1024.0))
+    finally:
+        server.terminate()
+
+if __name__ == '__main__':
+    main()
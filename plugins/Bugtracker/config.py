@@ -90,6 +90,11 @@ conf.registerChannelValue(Bugtracker, 'oopsSnarfer',
     enabled, such that any OOPS ### seen in the channel
     will have their information reported into the channel."""))
 
+conf.registerGlobalValue(Bugtracker, 'cveDatabase',
+    registry.Boolean(False, """Determines whether CVEs will be looked up in
+    the local CVE database first, which can be filled with the 'cveimport'
+    command. CVEs not found there are still looked up on the web."""))
+
 conf.registerChannelValue(Bugtracker, 'replyNoBugtracker',
     registry.String("I have no bugtracker '%s'", """Determines the phrase
     to use when notifying the user that there is no information about that
@@ -109,6 +114,139 @@ conf.registerGlobalValue(Bugtracker, 'replyWhenNotFound',
 conf.registerChannelValue(Bugtracker, 'repeatdelay',
     registry.Integer(60, """Number of seconds to wait between repeated bug calls"""))
 
+conf.registerGlobalValue(Bugtracker, 'lookupThreads',
+    registry.PositiveInteger(5, """Number of bugs that can be looked up at
+    the same time. The 'bug' command uses at most half of them, so that the
+    snarfers are not held up. Takes effect when the plugin is reloaded."""))
+
+conf.registerGlobalValue(Bugtracker, 'lookupTimeout',
+    registry.PositiveFloat(10.0, """Number of seconds to wait for a bug
+    lookup before giving up on it."""))
+
+conf.registerGlobalValue(Bugtracker, 'maxBugs',
+    registry.PositiveInteger(50, """Maximum number of bugs the 'bug' command
+    looks up at once."""))
+
+conf.registerGlobalValue(Bugtracker, 'connectionsPerHost',
+    registry.PositiveInteger(4, """Maximum number of simultaneous connections
+    to a single bugtracker host. Takes effect when the plugin is reloaded."""))
+
+conf.registerGlobalValue(Bugtracker, 'connectTimeout',
+    registry.PositiveFloat(5.0, """Number of seconds to wait for a connection
+    to a bugtracker to be established."""))
+
+conf.registerGlobalValue(Bugtracker, 'readTimeout',
+    registry.PositiveFloat(15.0, """Number of seconds to wait for a bugtracker
+    to respond."""))
+
+conf.registerGlobalValue(Bugtracker, 'breakerThreshold',
+    registry.PositiveInteger(5, """Number of failed lookups within
+    supybot.plugins.Bugtracker.breakerWindow after which a bugtracker is
+    considered unavailable, provided at least half of its lookups failed.
+    The bot then answers right away that it is unavailable, instead of
+    waiting for it to time out."""))
+
+conf.registerGlobalValue(Bugtracker, 'breakerWindow',
+    registry.PositiveInteger(300, """Number of seconds of recent lookups to
+    look at when deciding whether a bugtracker is unavailable."""))
+
+conf.registerGlobalValue(Bugtracker, 'breakerCooldown',
+    registry.PositiveInteger(60, """Number of seconds to wait before trying
+    an unavailable bugtracker again. If that single lookup works, the
+    bugtracker is considered available again."""))
+
+conf.registerGlobalValue(Bugtracker, 'timeoutFactor',
+    registry.PositiveFloat(3.0, """Once a bugtracker has answered enough
+    lookups, requests to it time out after this multiple of its 95th
+    percentile response time, rather than after
+    supybot.plugins.Bugtracker.readTimeout, which is still the upper
+    bound."""))
+
+conf.registerGlobalValue(Bugtracker, 'minTimeout',
+    registry.PositiveFloat(2.0, """Lower bound in seconds of the read timeout
+    derived from a bugtracker's response times."""))
+
+conf.registerGlobalValue(Bugtracker, 'apiTokens',
+    registry.SpaceSeparatedListOfStrings([], """Space separated list of
+    host=token pairs of API tokens to use for GitHub, GitLab and Gitea
+    bugtrackers, e.g. api.github.com=<token>. Authenticated requests are
+    allowed a much larger rate limit.""", private=True))
+
+conf.registerGlobalValue(Bugtracker, 'rateLimitReserve',
+    registry.NonNegativeInteger(10, """Number of requests of a rate limited
+    API to keep for bugs explicitly asked for. Snarfed bugs are not looked up
+    on that API anymore when fewer requests remain, until its rate limit is
+    reset. They are looked up then, so that their next mention is answered
+    from the cache."""))
+
+conf.registerGlobalValue(Bugtracker, 'rateLimitWait',
+    registry.PositiveFloat(5.0, """Number of seconds a lookup with the 'bug'
+    command may wait for the rate limit of an API to be reset. If it would
+    take longer, the lookup fails right away. Snarfed bugs never wait."""))
+
+conf.registerGlobalValue(Bugtracker, 'probeCacheTTL',
+    registry.NonNegativeInteger(86400, """Number of seconds to remember that a
+    host with GitLab or Gitea like bug URLs turned out to be neither, so that
+    it is not probed again every time it is mentioned."""))
+
+conf.registerGlobalValue(Bugtracker, 'probeErrorTTL',
+    registry.NonNegativeInteger(300, """Number of seconds to wait before
+    probing a host with GitLab or Gitea like bug URLs again, after it could
+    not be reached or answered with an error."""))
+
+conf.registerGlobalValue(Bugtracker, 'cacheSize',
+    registry.NonNegativeInteger(1000, """Maximum number of bug lookups to keep
+    in the cache. 0 disables caching."""))
+
+conf.registerGlobalValue(Bugtracker, 'cacheTTL',
+    registry.NonNegativeInteger(300, """Number of seconds to cache information
+    about a bug. 0 disables caching of found bugs."""))
+
+conf.registerGlobalValue(Bugtracker, 'cacheNotFoundTTL',
+    registry.NonNegativeInteger(600, """Number of seconds to remember that a
+    bug could not be found. 0 disables caching of missing bugs."""))
+
+conf.registerGlobalValue(Bugtracker, 'cacheErrorTTL',
+    registry.NonNegativeInteger(30, """Number of seconds to remember that a
+    bugtracker returned an error for a bug. 0 disables caching of errors."""))
+
+conf.registerGlobalValue(Bugtracker, 'cacheStaleTTL',
+    registry.NonNegativeInteger(600, """Number of seconds after a cached bug
+    expired during which it may still be shown, if it is a hot bug (see
+    supybot.plugins.Bugtracker.hotBugMentions). It is then looked up again
+    in the background, so the next mention shows the refreshed bug. 0
+    disables this."""))
+
+conf.registerGlobalValue(Bugtracker, 'hotBugs',
+    registry.NonNegativeInteger(100, """Maximum number of hot bugs, which are
+    looked up again before they expire from the cache, and may be shown from
+    the cache while they are being refreshed. When there are more, the most
+    mentioned ones are kept. 0 disables this."""))
+
+conf.registerGlobalValue(Bugtracker, 'hotBugMentions',
+    registry.PositiveInteger(3, """Number of mentions within
+    supybot.plugins.Bugtracker.hotBugsWindow that make a bug hot."""))
+
+conf.registerGlobalValue(Bugtracker, 'hotBugsWindow',
+    registry.PositiveInteger(3600, """Number of seconds of mentions to count
+    when finding the hot bugs."""))
+
+conf.registerGlobalValue(Bugtracker, 'hotBugsInterval',
+    registry.PositiveInteger(60, """Number of seconds between looking up the
+    hot bugs that are about to expire from the cache. Takes effect when the
+    plugin is reloaded."""))
+
+conf.registerGlobalValue(Bugtracker, 'validatorCacheSize',
+    registry.NonNegativeInteger(2000, """Maximum number of bugs to keep along
+    with the ETag or Last-Modified header of their document, so trackers that
+    support it can answer "not modified" instead of resending it."""))
+
+conf.registerGlobalValue(Bugtracker, 'metricsInterval',
+    registry.NonNegativeInteger(0, """Number of seconds between writes of the
+    lookup stats shown by the 'stats' command to Bugtracker-metrics.prom in
+    the data directory, in the Prometheus text format. 0 disables this.
+    Takes effect when the plugin is reloaded."""))
+
 conf.registerChannelValue(Bugtracker, 'showassignee',
     registry.Boolean(False, """Whether to show the assignee in bug reports"""))
 
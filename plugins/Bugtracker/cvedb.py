@@ -0,0 +1,99 @@
+# -*- Encoding: utf-8 -*-
+###
+# Copyright (c) 2005-2007 Dennis Kaarsemaker
+# Copyright (c) 2008-2010 Terence Simpson
+# Copyright (c) 2017-     Krytarik Raido
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of version 2 of the GNU General Public License as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+###
+
+import os, gzip, json, sqlite3, threading
+
+def _english(descriptions, key='value'):
+    for d in descriptions:
+        if d.get('lang', '').startswith('en'):
+            return d[key]
+    if descriptions:
+        return descriptions[0][key]
+
+def _records(data):
+    """Yield (id, modified, description) for each CVE in a feed file.
+    Understands NVD 1.1 JSON feeds, NVD 2.0 API responses, and CVE JSON 5
+    records as published in the cvelistV5 repository."""
+    if 'CVE_Items' in data: # NVD 1.1
+        for item in data['CVE_Items']:
+            cve = item['cve']
+            yield (cve['CVE_data_meta']['ID'], item.get('lastModifiedDate', ''),
+                   _english(cve['description']['description_data']))
+    elif 'vulnerabilities' in data: # NVD 2.0
+        for item in data['vulnerabilities']:
+            cve = item['cve']
+            yield (cve['id'], cve.get('lastModified', ''), _english(cve.get('descriptions', [])))
+    elif 'cveMetadata' in data: # CVE JSON 5
+        meta = data['cveMetadata']
+        cna = data.get('containers', {}).get('cna', {})
+        if meta.get('state') == 'REJECTED':
+            reason = _english(cna.get('rejectedReasons', []))
+            description = '** REJECT ** %s' % reason if reason else '** REJECT **'
+        else:
+            description = _english(cna.get('descriptions', []))
+        yield (meta['cveId'], meta.get('dateUpdated', ''), description)
+
+class CVEDatabase:
+    """CVE descriptions in a local sqlite database"""
+    def __init__(self, filename):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS cve (
+                               id          TEXT PRIMARY KEY,
+                               modified    TEXT,
+                               description TEXT
+                           ) WITHOUT ROWID""")
+        self.db.commit()
+
+    def get(self, id):
+        with self.lock:
+            row = self.db.execute('SELECT description FROM cve WHERE id = ?', (id.upper(),)).fetchone()
+        if row:
+            return row[0]
+
+    def update(self, records):
+        """Store records, unless we already have a newer version of them.
+        Returns the number of records read."""
+        records = [(id.upper(), modified, description) for (id, modified, description) in records if description]
+        with self.lock:
+            with self.db:
+                self.db.executemany("""INSERT INTO cve (id, modified, description) VALUES (?, ?, ?)
+                                       ON CONFLICT (id) DO UPDATE SET
+                                           modified = excluded.modified,
+                                           description = excluded.description
+                                       WHERE excluded.modified >= cve.modified""", records)
+        return len(records)
+
+    def import_path(self, path):
+        """Import a feed file, possibly gzipped, or every JSON file under a
+        directory, such as the deltaCves directory of a cvelistV5 release.
+        Returns the number of records read."""
+        if os.path.isdir(path):
+            count = 0
+            for (dirpath, dirnames, filenames) in os.walk(path):
+                for filename in sorted(filenames):
+                    if filename.endswith(('.json', '.json.gz')):
+                        count += self.import_path(os.path.join(dirpath, filename))
+            return count
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as fd:
+            data = json.load(fd)
+        return self.update(_records(data))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,305 @@
+# -*- Encoding: utf-8 -*-
+###
+# Copyright (c) 2005-2007 Dennis Kaarsemaker
+# Copyright (c) 2008-2010 Terence Simpson
+# Copyright (c) 2017-     Krytarik Raido
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of version 2 of the GNU General Public License as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+###
+
+import supybot.utils as utils
+
+import ssl, time, gzip, zlib, socket, threading
+import http.client
+import urllib.request, urllib.error
+from urllib.parse import urlsplit, urljoin
+
+redirect_codes = (301, 302, 303, 307, 308)
+
+# Not sent on to another host when redirected there, like requests does
+auth_headers = ('authorization', 'private-token', 'cookie')
+
+def redirect_headers(url, location, headers):
+    """headers to send to location, which url redirected to"""
+    if not headers or urlsplit(url)[:2] == urlsplit(location)[:2]:
+        return headers
+    return dict((name, value) for (name, value) in headers.items() if name.lower() not in auth_headers)
+
+class Response:
+    """A fully read HTTP response"""
+    def __init__(self, url, status, reason, headers, data):
+        self.url     = url
+        self.status  = status
+        self.reason  = reason
+        self.headers = headers
+        self.data    = data
+
+    def check(self):
+        """Raise an error like utils.web.getUrl does for HTTP errors"""
+        if self.status >= 400:
+            raise utils.web.Error('HTTP Error %d: %s' % (self.status, self.reason))
+        return self
+
+class Host:
+    """Idle connections to one host, and the slots limiting how many
+    requests may be in flight to it at once"""
+    def __init__(self, limit):
+        self.slots = threading.BoundedSemaphore(limit)
+        self.idle  = []
+        self.lock  = threading.Lock()
+
+    def get(self, maxidle):
+        with self.lock:
+            while self.idle:
+                (conn, since) = self.idle.pop()
+                if since > time.time() - maxidle:
+                    return conn
+                conn.close()
+
+    def put(self, conn):
+        with self.lock:
+            self.idle.append((conn, time.time()))
+
+    def close(self):
+        with self.lock:
+            for (conn, since) in self.idle:
+                conn.close()
+            self.idle = []
+
+class HTTPPool:
+    """Keep-alive HTTP(S) connections, pooled per host"""
+    def __init__(self):
+        self.hosts          = {}
+        self.lock           = threading.Lock()
+        self.context        = ssl.create_default_context()
+        self.maxPerHost     = 4
+        self.connectTimeout = 5.0
+        self.readTimeout    = 15.0
+        self.maxIdle        = 60.0
+        self.maxRedirects   = 5
+
+    def host(self, scheme, netloc):
+        with self.lock:
+            try:
+                return self.hosts[(scheme, netloc)]
+            except KeyError:
+                host = self.hosts[(scheme, netloc)] = Host(self.maxPerHost)
+                return host
+
+    def connect(self, scheme, netloc, timeout):
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(netloc, timeout=timeout[0], context=self.context)
+        elif scheme == 'http':
+            conn = http.client.HTTPConnection(netloc, timeout=timeout[0])
+        else:
+            raise utils.web.Error('Unsupported URL scheme: %s' % scheme)
+        conn.connect()
+        return conn
+
+    def exchange(self, conn, method, path, data, headers, timeout):
+        try:
+            conn.sock.settimeout(timeout[1])
+            conn.request(method, path, body=data, headers=headers)
+            return conn.getresponse()
+        except:
+            conn.close()
+            raise
+
+    def open(self, host, parts, data, headers, timeout):
+        """Send a request to host, on an idle connection if there is one.
+        Returns the connection and the response, whose body is unread."""
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        allheaders = dict(utils.web.defaultHeaders)
+        allheaders['Accept-Encoding'] = 'gzip, deflate'
+        if headers:
+            allheaders.update(headers)
+        method = 'POST' if data else 'GET'
+        conn = host.get(self.maxIdle)
+        if conn:
+            try:
+                return (conn, self.exchange(conn, method, path, data, allheaders, timeout))
+            except (http.client.RemoteDisconnected, ConnectionError):
+                # The server dropped the idle connection, retry on a fresh one
+                pass
+            except socket.timeout:
+                raise utils.web.Error('Connection timed out.')
+            except (http.client.HTTPException, OSError) as e:
+                raise utils.web.Error(str(e))
+        try:
+            conn = self.connect(parts.scheme, parts.netloc, timeout)
+            return (conn, self.exchange(conn, method, path, data, allheaders, timeout))
+        except socket.timeout:
+            raise utils.web.Error('Connection timed out.')
+        except (http.client.HTTPException, OSError) as e:
+            raise utils.web.Error(str(e))
+
+    @staticmethod
+    def read(conn, response, size=None):
+        try:
+            return response.read(size)
+        except:
+            conn.close()
+            raise
+
+    def request(self, url, headers=None, data=None, timeout=None):
+        """Request url, following redirects, and return the Response.
+        timeout is a (connect, read) tuple of seconds."""
+        for i in range(self.maxRedirects + 1):
+            response = self.request_once(url, headers, data, timeout)
+            if response.status not in redirect_codes or 'Location' not in response.headers:
+                return response
+            location = urljoin(url, response.headers['Location'])
+            headers = redirect_headers(url, location, headers)
+            url = location
+            if response.status not in (307, 308):
+                data = None
+        raise utils.web.Error('Too many redirects (%s)' % url)
+
+    def request_once(self, url, headers=None, data=None, timeout=None):
+        parts = urlsplit(url)
+        if not timeout:
+            timeout = (self.connectTimeout, self.readTimeout)
+        host = self.host(parts.scheme, parts.netloc)
+        if not host.slots.acquire(timeout=timeout[1]):
+            raise utils.web.Error('Too many connections to %s' % parts.netloc)
+        try:
+            (conn, response) = self.open(host, parts, data, headers, timeout)
+            try:
+                body = self.read(conn, response)
+            except socket.timeout:
+                raise utils.web.Error('Connection timed out.')
+            except (http.client.HTTPException, OSError) as e:
+                raise utils.web.Error(str(e))
+            if response.will_close:
+                conn.close()
+            else:
+                host.put(conn)
+        finally:
+            host.slots.release()
+        encoding = response.getheader('Content-Encoding', '').lower()
+        try:
+            if encoding == 'gzip':
+                body = gzip.decompress(body)
+            elif encoding == 'deflate':
+                try:
+                    body = zlib.decompress(body)
+                except zlib.error:
+                    body = zlib.decompress(body, -zlib.MAX_WBITS)
+        except (OSError, EOFError, zlib.error) as e:
+            raise utils.web.Error('Could not decompress response: %s' % e)
+        return Response(url, response.status, response.reason, response.headers, body)
+
+    def stream(self, url, headers=None, timeout=None, chunksize=16384):
+        """Request url, following redirects, and yield the body in chunks
+        as it arrives. HTTP errors are raised like getUrl does. Close the
+        generator to stop reading early, its connection is not reused then."""
+        if not timeout:
+            timeout = (self.connectTimeout, self.readTimeout)
+        for i in range(self.maxRedirects + 1):
+            parts = urlsplit(url)
+            host = self.host(parts.scheme, parts.netloc)
+            if not host.slots.acquire(timeout=timeout[1]):
+                raise utils.web.Error('Too many connections to %s' % parts.netloc)
+            try:
+                (conn, response) = self.open(host, parts, None, headers, timeout)
+                if response.status in redirect_codes and 'Location' in response.headers:
+                    conn.close()
+                    location = urljoin(url, response.headers['Location'])
+                    headers = redirect_headers(url, location, headers)
+                    url = location
+                    continue
+                if response.status >= 400:
+                    conn.close()
+                    raise utils.web.Error('HTTP Error %d: %s' % (response.status, response.reason))
+                encoding = response.getheader('Content-Encoding', '').lower()
+                if encoding == 'gzip':
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                elif encoding == 'deflate':
+                    decompressor = zlib.decompressobj()
+                else:
+                    decompressor = None
+                done = False
+                try:
+                    while True:
+                        try:
+                            chunk = self.read(conn, response, chunksize)
+                        except socket.timeout:
+                            raise utils.web.Error('Connection timed out.')
+                        except (http.client.HTTPException, OSError) as e:
+                            raise utils.web.Error(str(e))
+                        if not chunk:
+                            break
+                        if not decompressor:
+                            yield chunk
+                            continue
+                        # Compressed data can expand a lot, so decompress it
+                        # a chunk at a time too
+                        while chunk:
+                            try:
+                                data = decompressor.decompress(chunk, chunksize)
+                            except zlib.error as e:
+                                raise utils.web.Error('Could not decompress response: %s' % e)
+                            chunk = decompressor.unconsumed_tail
+                            if data:
+                                yield data
+                    done = True
+                finally:
+                    if done and not response.will_close:
+                        host.put(conn)
+                    else:
+                        conn.close()
+                return
+            finally:
+                host.slots.release()
+        raise utils.web.Error('Too many redirects (%s)' % url)
+
+    def getUrl(self, url, headers=None, data=None, timeout=None):
+        """Like utils.web.getUrl, but through the pool"""
+        return self.request(url, headers, data, timeout).check().data
+
+    def close(self):
+        with self.lock:
+            for host in self.hosts.values():
+                host.close()
+            self.hosts = {}
+
+def proxy_request(url, headers=None, data=None, timeout=None):
+    """Request url through the opener installed for the configured proxy,
+    and return the Response. HTTP errors, including 304 Not Modified, are
+    returned with their status and headers like any other response, as
+    they are by the pool. timeout is the read timeout in seconds."""
+    allheaders = dict(utils.web.defaultHeaders)
+    if headers:
+        allheaders.update(headers)
+    request = urllib.request.Request(url, data=data)
+    for (name, value) in allheaders.items():
+        # urllib keeps headers on redirects, except unredirected ones
+        if name.lower() in auth_headers:
+            request.add_unredirected_header(name, value)
+        else:
+            request.add_header(name, value)
+    try:
+        try:
+            fd = urllib.request.urlopen(request, timeout=timeout)
+        except urllib.error.HTTPError as e:
+            fd = e
+        with fd:
+            return Response(fd.geturl(), fd.getcode(), fd.reason, fd.headers, fd.read())
+    except socket.timeout:
+        raise utils.web.Error('Connection timed out.')
+    except urllib.error.URLError as e:
+        raise utils.web.Error(str(e.reason))
+    except (http.client.HTTPException, OSError, ValueError) as e:
+        raise utils.web.Error(str(e))
+
+pool = HTTPPool()
@@ -18,16 +18,32 @@
 from supybot.commands import *
 import supybot.utils as utils
 import supybot.ircutils as ircutils
-import supybot.ircdb as ircdb
 import supybot.callbacks as callbacks
 import supybot.conf as conf
 import supybot.registry as registry
 import supybot.log as supylog
+import supybot.schedule as schedule
 
-import re, os, sys, time, json
-import xml.dom.minidom as minidom
+import re, os, sys, time, json, base64, bisect, threading
+from collections import OrderedDict, Counter, deque, namedtuple
+from concurrent import futures
+import xml.etree.ElementTree as ElementTree
 from email.parser import FeedParser
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
 from pysimplesoap.client import SoapClient
+from pysimplesoap.simplexml import SimpleXMLElement
+from imp import reload
+# Modules shared by several plugins are kept in a package next to them
+plugins_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if plugins_dir not in sys.path:
+    sys.path.append(plugins_dir)
+from ubottu_common import expiry, usercache
+from . import httppool, cvedb
+reload(httppool)
+reload(expiry)
+reload(usercache)
+reload(cvedb)
 
 def registerBugtracker(name, url='', description='', trackertype=''):
     conf.supybot.plugins.Bugtracker.bugtrackers().add(name)
@@ -45,34 +61,13 @@ def registerBugtracker(name, url='', description='', trackertype=''):
         else:
             raise BugtrackerError("Unknown trackertype: %s" % trackertype)
 
-def defaultIgnored(hostmask, recipient):
+def defaultIgnored(user, recipient):
     if not conf.supybot.defaultIgnore():
         return False
     if conf.version <= '0.83.4.1' \
             and ircutils.isChannel(recipient):
         return False
-    try:
-        user = ircdb.users.getUser(hostmask)
-    except KeyError:
-        return True
-    return False
-
-def checkIgnored(hostmask, recipient):
-    try:
-        user = ircdb.users.getUser(hostmask)
-        if user._checkCapability('owner'):
-            return False
-        elif user.ignore:
-            return True
-    except KeyError:
-        pass
-    if ircdb.ignores.checkIgnored(hostmask):
-        return True
-    if ircutils.isChannel(recipient):
-        c = ircdb.channels.getChannel(recipient)
-        if c.checkIgnored(hostmask):
-            return True
-    return False
+    return not user
 
 def checkAddressed(text, channel):
     if channel:
@@ -82,30 +77,220 @@ def checkAddressed(text, channel):
         return True
     return False
 
+# Seconds lookups on the current thread spent waiting for bugtrackers, so
+# that this can be told apart from the time spent parsing their answers
+lookup_timing = threading.local()
+
+def add_fetch_time(start):
+    lookup_timing.fetch = getattr(lookup_timing, 'fetch', 0.0) + time.time() - start
+
+def request_url(url, headers=None, data=None, timeout=None):
+    """Request url through the shared keep-alive connection pool, and
+    return the whole response. timeout is the read timeout in seconds."""
+    if not timeout:
+        timeout = conf.supybot.plugins.Bugtracker.readTimeout()
+    start = time.time()
+    try:
+        if conf.supybot.protocols.http.proxy():
+            return httppool.proxy_request(url, headers, data, timeout)
+        return httppool.pool.request(url, headers, data, (conf.supybot.plugins.Bugtracker.connectTimeout(), timeout))
+    finally:
+        add_fetch_time(start)
+
+def fetch_url(url, headers=None, data=None):
+    """Get url through the shared keep-alive connection pool"""
+    return request_url(url, headers, data).check().data
+
+def stream_url(url, headers=None, timeout=None):
+    """Get url through the shared keep-alive connection pool, in chunks
+    as they arrive"""
+    if not timeout:
+        timeout = conf.supybot.plugins.Bugtracker.readTimeout()
+    if conf.supybot.protocols.http.proxy():
+        def stream():
+            yield utils.web.getUrl(url, headers=headers, timeout=timeout)
+        chunks = stream()
+    else:
+        chunks = httppool.pool.stream(url, headers, (conf.supybot.plugins.Bugtracker.connectTimeout(), timeout))
+    # Only count the time spent waiting for chunks, not parsing them
+    def timed():
+        try:
+            while True:
+                start = time.time()
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    return
+                finally:
+                    add_fetch_time(start)
+                yield chunk
+        finally:
+            chunks.close()
+    return timed()
+
+class Validators:
+    """Bug record last parsed from the JSON document of a URL, with the ETag
+    and Last-Modified headers needed to revalidate it"""
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, url):
+        with self.lock:
+            try:
+                self.entries.move_to_end(url)
+                return self.entries[url]
+            except KeyError:
+                return None
+
+    def put(self, url, etag, modified, record):
+        size = conf.supybot.plugins.Bugtracker.validatorCacheSize()
+        with self.lock:
+            self.entries[url] = (etag, modified, record)
+            self.entries.move_to_end(url)
+            while len(self.entries) > size:
+                self.entries.popitem(last=False)
+
+validators = Validators()
+
+# Whether lookups on the current thread were explicitly asked for, rather
+# than snarfed. Those may use the API budget kept in reserve.
+lookup_priority = threading.local()
+
+def is_urgent():
+    return getattr(lookup_priority, 'urgent', False)
+
+class RateLimited(utils.web.Error):
+    """A request was not made, because it would exceed the rate limit"""
+    def __init__(self, message, reset=0):
+        utils.web.Error.__init__(self, message)
+        self.reset = reset # When the budget is reset, if we know
+
+class RateLimit:
+    """What we know of the API rate limit of one host"""
+    def __init__(self):
+        self.remaining = None # Unknown until the host tells us
+        self.reset     = 0
+        self.until     = 0    # Retry-After
+        self.lock      = threading.Lock()
+
+class RateLimits:
+    """API request budgets per host, fed by rate limit response headers.
+    Snarfed lookups leave some requests of the budget for commands."""
+    def __init__(self):
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def get(self, host):
+        with self.lock:
+            try:
+                return self.hosts[host]
+            except KeyError:
+                limit = self.hosts[host] = RateLimit()
+                return limit
+
+    def acquire(self, host):
+        """Take a request from the budget of host. Urgent lookups wait a
+        little for the budget to be reset if needed, others do not, as the
+        snarfers must not hold the bot up. Raises RateLimited if the budget
+        is used up for longer than we can wait."""
+        limit = self.get(host)
+        if is_urgent():
+            reserve = 0
+            maxwait = conf.supybot.plugins.Bugtracker.rateLimitWait()
+        else:
+            reserve = conf.supybot.plugins.Bugtracker.rateLimitReserve()
+            maxwait = 0
+        while True:
+            with limit.lock:
+                now = time.time()
+                if limit.reset <= now:
+                    limit.remaining = None
+                if limit.until > now:
+                    wait = limit.until - now
+                elif limit.remaining is not None and limit.remaining <= reserve:
+                    wait = limit.reset - now
+                else:
+                    if limit.remaining is not None:
+                        limit.remaining -= 1
+                    return
+            if wait > maxwait:
+                raise RateLimited('Rate limit of %s exceeded, retry in %d seconds' % (host, wait + 1),
+                                  time.time() + wait)
+            maxwait -= wait
+            time.sleep(wait)
+
+    def update(self, host, response):
+        """Learn the budget of host from the headers of a response. Returns
+        whether the response says the budget is used up."""
+        headers = response.headers
+        limit = self.get(host)
+        now = time.time()
+        with limit.lock:
+            remaining = headers.get('X-RateLimit-Remaining') or headers.get('RateLimit-Remaining')
+            reset = headers.get('X-RateLimit-Reset') or headers.get('RateLimit-Reset')
+            retry = headers.get('Retry-After')
+            try:
+                if remaining is not None and reset is not None:
+                    reset = float(reset)
+                    # Either a timestamp, or the number of seconds left
+                    limit.reset = reset if reset > 1e9 else now + reset
+                    limit.remaining = int(remaining)
+                if retry is not None:
+                    if retry.strip().isdigit():
+                        limit.until = now + int(retry)
+                    else:
+                        limit.until = parsedate_to_datetime(retry).timestamp()
+            except (ValueError, TypeError):
+                pass
+            return response.status in (403, 429) and (limit.until > now or limit.remaining == 0)
+
+    def reset(self, host):
+        """When the budget of host is reset, as far as we know"""
+        limit = self.get(host)
+        with limit.lock:
+            return max(limit.until, limit.reset)
+
+ratelimits = RateLimits()
+
+def api_token(host):
+    """The API token configured for host, if any"""
+    for token in conf.supybot.plugins.Bugtracker.apiTokens():
+        (tokenhost, sep, token) = token.partition('=')
+        if sep and tokenhost.lower() == host:
+            return token
+
 def _getnodetxt(node):
-    L = []
-    for childnode in node.childNodes:
-        if childnode.nodeType == childnode.TEXT_NODE:
-            L.append(childnode.data)
-    if not L:
+    val = node.text
+    if not val:
         raise ValueError("No text nodes")
-    val = ''.join(L)
-    if node.hasAttribute('encoding'):
-        encoding = node.getAttribute('encoding')
-        if encoding == 'base64':
-            try:
-                val = val.decode('base64')
-            except:
-                val = 'Cannot convert bug data from base64.'
+    if node.get('encoding') == 'base64':
+        try:
+            val = base64.b64decode(val).decode('utf-8')
+        except:
+            val = 'Cannot convert bug data from base64.'
     return utils.web.htmlToText(val, tagReplace='')
 
 def _getnodeattr(node, attr):
-    if node.hasAttribute(attr):
-        val = node.getAttribute(attr)
-    else:
+    val = node.get(attr)
+    if val is None:
         raise ValueError("No such attribute")
     return utils.web.htmlToText(val, tagReplace='')
 
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+class BugRecord(namedtuple('BugRecord', 'id product title severity status assignee url extinfo duplicate')):
+    """What we know of a bug. Immutable and compact for keeping in the
+    cache: it has no per-instance dict, the few distinct products,
+    severities and statuses are shared rather than copied, and extinfo and
+    duplicate are tuples."""
+    __slots__ = ()
+
+    def __new__(cls, id, product, title, severity, status, assignee, url, extinfo=(), duplicate=()):
+        return super(BugRecord, cls).__new__(cls, id, _intern(product), title, _intern(severity), _intern(status),
+                                             assignee, url, tuple(extinfo), tuple(duplicate))
+
 class BugtrackerError(Exception):
     """A bugtracker error"""
     pass
@@ -114,36 +299,677 @@ class BugNotFoundError(Exception):
     """Pity, bug isn't there"""
     pass
 
+class BugCache:
+    """LRU cache of bug lookups, keyed on (tracker URL, bug id).
+    Misses and errors are cached too, each with their own TTL. Bugs that
+    expired are kept for a while longer, to be served while they are
+    looked up again."""
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached (bugdata, error) pair for key, or None"""
+        with self.lock:
+            try:
+                (expires, bugdata, error) = self.entries[key]
+            except KeyError:
+                return None
+            now = time.time()
+            if expires <= now:
+                if error or expires + conf.supybot.plugins.Bugtracker.cacheStaleTTL() <= now:
+                    del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return (bugdata, error)
+
+    def get_stale(self, key):
+        """Return the bug data for key, even if it expired not too long ago"""
+        with self.lock:
+            try:
+                (expires, bugdata, error) = self.entries[key]
+            except KeyError:
+                return None
+            if error:
+                return None
+            if expires + conf.supybot.plugins.Bugtracker.cacheStaleTTL() <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return bugdata
+
+    def put(self, key, bugdata=None, error=None):
+        if isinstance(error, BugNotFoundError):
+            ttl = conf.supybot.plugins.Bugtracker.cacheNotFoundTTL()
+        elif error:
+            ttl = conf.supybot.plugins.Bugtracker.cacheErrorTTL()
+        else:
+            ttl = conf.supybot.plugins.Bugtracker.cacheTTL()
+        size = conf.supybot.plugins.Bugtracker.cacheSize()
+        if ttl <= 0 or size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.time() + ttl, bugdata, error)
+            self.entries.move_to_end(key)
+            while len(self.entries) > size:
+                self.entries.popitem(last=False)
+
+    def expires(self, key):
+        """When the bug data cached for key expires, or None if we have none"""
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry and entry[1]:
+            return entry[0]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class Popularity:
+    """How often bugs were mentioned recently. Bugs mentioned often enough
+    are hot, until they are not mentioned that often anymore. When there is
+    no room left, a bug mentioned more often than the coolest hot bug takes
+    its place."""
+    def __init__(self):
+        self.mentions = deque() # (time, key)
+        self.counts   = Counter()
+        self.hot      = {}      # key: tracker
+        self.lock     = threading.Lock()
+
+    def _expire(self, now):
+        since = now - conf.supybot.plugins.Bugtracker.hotBugsWindow()
+        threshold = conf.supybot.plugins.Bugtracker.hotBugMentions()
+        while self.mentions and self.mentions[0][0] <= since:
+            (when, key) = self.mentions.popleft()
+            self.counts[key] -= 1
+            if self.counts[key] < threshold:
+                self.hot.pop(key, None)
+            if not self.counts[key]:
+                del self.counts[key]
+
+    def mention(self, key, tracker):
+        now = time.time()
+        with self.lock:
+            self._expire(now)
+            self.mentions.append((now, key))
+            self.counts[key] += 1
+            if key in self.hot or self.counts[key] < conf.supybot.plugins.Bugtracker.hotBugMentions():
+                return
+            maxhot = conf.supybot.plugins.Bugtracker.hotBugs()
+            if len(self.hot) >= maxhot and self.hot:
+                coolest = min(self.hot, key=self.counts.__getitem__)
+                if self.counts[coolest] >= self.counts[key]:
+                    return
+                del self.hot[coolest]
+            if len(self.hot) < maxhot:
+                self.hot[key] = tracker
+
+    def is_hot(self, key):
+        with self.lock:
+            self._expire(time.time())
+            return key in self.hot
+
+    def hot_bugs(self):
+        """(key, tracker) of each hot bug"""
+        with self.lock:
+            self._expire(time.time())
+            return list(self.hot.items())
+
+class InFlight:
+    """Bug lookups in progress, so that concurrent lookups of the same bug
+    wait for the first one instead of asking the tracker again"""
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def claim(self, key):
+        """Returns a future of the result for key, and whether the caller
+        is the one to look it up and then finish() it"""
+        with self.lock:
+            try:
+                return (self.calls[key], False)
+            except KeyError:
+                future = self.calls[key] = futures.Future()
+                return (future, True)
+
+    def finish(self, key, bugdata=None, error=None):
+        with self.lock:
+            future = self.calls.pop(key)
+        if error:
+            future.set_exception(error)
+        else:
+            future.set_result(bugdata)
+
+    @staticmethod
+    def wait(future):
+        try:
+            return future.result()
+        except (BugNotFoundError, BugtrackerError) as e:
+            # Every waiter gets its own exception to raise
+            raise e.__class__(*e.args)
+
+class TrackerIndex:
+    """Bugtrackers by host, longest URL path first, so that the tracker
+    for a snarfed URL can be found without trying all of them"""
+    def __init__(self):
+        self.hosts = {}
+
+    @staticmethod
+    def split(url):
+        if '://' in url:
+            url = url[url.rfind('://')+3:]
+        (host, slash, path) = url.partition('/')
+        return (host.lower(), slash + path)
+
+    def add(self, tracker):
+        (host, path) = self.split(tracker.url)
+        # Lookups may be reading the old list, so swap in a new one.
+        # Sorting is stable, so the first tracker added wins among equal paths.
+        self.hosts[host] = sorted(self.hosts.get(host, []) + [(path, tracker)], key=lambda t: -len(t[0]))
+
+    def remove(self, tracker):
+        (host, path) = self.split(tracker.url)
+        trackers = [t for t in self.hosts.get(host, []) if t[1] is not tracker]
+        if trackers:
+            self.hosts[host] = trackers
+        else:
+            self.hosts.pop(host, None)
+
+    def find(self, url):
+        (host, path) = self.split(url)
+        # Trackers also cover subdomains, e.g. launchpad.net for bugs.launchpad.net
+        labels = host.split('.')
+        for i in range(len(labels)):
+            for (prefix, tracker) in self.hosts.get('.'.join(labels[i:]), []):
+                if path.startswith(prefix):
+                    return tracker
+
+class Abbreviations:
+    """Unambiguous abbreviations of tracker names, as utils.abbrev() finds
+    them, in a prefix tree that is updated as trackers are added and
+    removed rather than rebuilt. A full name always stands for itself,
+    even if it is also the start of other names."""
+    def __init__(self, names=()):
+        self.root = [{}, 0, None] # [children by character, number of names below, name ending here]
+        self.lock = threading.Lock()
+        for name in names:
+            self.add(name)
+
+    def _path(self, name):
+        """Nodes for each character of name, as far as they exist"""
+        path = [self.root]
+        for c in name:
+            node = path[-1][0].get(c)
+            if not node:
+                break
+            path.append(node)
+        return path
+
+    def add(self, name):
+        with self.lock:
+            path = self._path(name)
+            if len(path) == len(name) + 1 and path[-1][2] is not None:
+                return
+            node = self.root
+            for c in name:
+                node[1] += 1
+                node = node[0].setdefault(c, [{}, 0, None])
+            node[1] += 1
+            node[2] = name
+
+    def remove(self, name):
+        with self.lock:
+            path = self._path(name)
+            if len(path) != len(name) + 1 or path[-1][2] is None:
+                raise KeyError(name)
+            path[-1][2] = None
+            self.root[1] -= 1
+            for i in range(1, len(path)):
+                path[i][1] -= 1
+                if not path[i][1]: # Nothing left below, drop the branch
+                    del path[i-1][0][name[i-1]]
+                    break
+
+    def __getitem__(self, abbreviation):
+        with self.lock:
+            if not abbreviation:
+                raise KeyError(abbreviation)
+            node = self.root
+            for c in abbreviation:
+                node = node[0][c]
+            while node[2] is None:
+                if node[1] != 1:
+                    raise KeyError(abbreviation)
+                (node,) = node[0].values()
+            return node[2]
+
+class TrackerHealth:
+    """Rolling latency and error rate of a bugtracker. Trips a circuit
+    breaker when too many lookups fail, so we stop waiting on a tracker
+    that is down, and then lets a single probe through now and then to
+    see whether it is back."""
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self):
+        self.samples = deque(maxlen=100) # (time, latency, ok)
+        self.state   = self.CLOSED
+        self.opened  = 0
+        self.probing = False
+        self.lock    = threading.Lock()
+
+    def allow(self):
+        """Whether a lookup may go to the tracker now"""
+        with self.lock:
+            if self.state == self.OPEN and self.opened + conf.supybot.plugins.Bugtracker.breakerCooldown() <= time.time():
+                self.state = self.HALF_OPEN
+                self.probing = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record(self, latency, ok):
+        now = time.time()
+        with self.lock:
+            self.samples.append((now, latency, ok))
+            if self.state == self.HALF_OPEN:
+                if ok:
+                    self.state = self.CLOSED
+                else:
+                    self.state = self.OPEN
+                    self.opened = now
+                return
+            since = now - conf.supybot.plugins.Bugtracker.breakerWindow()
+            recent = [s[2] for s in self.samples if s[0] >= since]
+            failures = recent.count(False)
+            if failures >= conf.supybot.plugins.Bugtracker.breakerThreshold() and failures * 2 >= len(recent):
+                self.state = self.OPEN
+                self.opened = now
+
+    def release(self):
+        """Let another probe through, as the last one told us nothing"""
+        with self.lock:
+            self.probing = False
+
+    def call(self, tracker, func, *args):
+        """Call func(*args) if the breaker allows it, recording how long it
+        took and whether it worked. A missing bug is a working tracker, but
+        several bugs that all failed to be looked up are a failed lookup."""
+        if not self.allow():
+            tracker.stats.count('unavailable')
+            raise BugtrackerError('%s is currently unavailable' % tracker.description)
+        start = time.time()
+        ok = False
+        try:
+            result = func(*args)
+            ok = True
+            if isinstance(result, dict) and result:
+                errors = [e for e in result.values() if isinstance(e, BugtrackerError)]
+                if len(errors) == len(result):
+                    ok = None if all(isinstance(e.__context__, RateLimited) for e in errors) else False
+            return result
+        except BugNotFoundError:
+            ok = True
+            raise
+        except BugtrackerError as e:
+            # Being rate limited says nothing about the tracker's health
+            if isinstance(e.__context__, RateLimited):
+                ok = None
+            raise
+        finally:
+            if ok is None:
+                self.release()
+            else:
+                self.record(time.time() - start, ok)
+
+    def timeout(self):
+        """Read timeout for requests to the tracker: a multiple of its
+        95th percentile latency, within the configured bounds"""
+        maximum = conf.supybot.plugins.Bugtracker.readTimeout()
+        with self.lock:
+            latencies = sorted(s[1] for s in self.samples if s[2])
+        if len(latencies) < 10:
+            return maximum
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        return min(maximum, max(conf.supybot.plugins.Bugtracker.minTimeout(),
+                                p95 * conf.supybot.plugins.Bugtracker.timeoutFactor()))
+
+class Histogram:
+    """Counts of durations by the smallest bucket they fit in, as the
+    Prometheus histograms are made of"""
+    buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.buckets) + 1) # The last one is +Inf
+        self.sum    = 0.0
+        self.count  = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate of the q quantile, interpolating within its bucket"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for (i, count) in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i-1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+
+class TrackerStats:
+    """Lookup counters and latency histograms of a bugtracker. The latency
+    of a lookup is split into the time spent waiting for the tracker
+    (fetch) and the rest of it (parse); formatting the reply is timed
+    separately."""
+    counters = ('lookups', 'cached', 'stale', 'coalesced', 'found', 'notfound', 'errors',
+                'unavailable', 'suppressed')
+    phases   = ('fetch', 'parse', 'format')
+
+    def __init__(self):
+        self.counts  = Counter()
+        self.latency = dict((phase, Histogram()) for phase in self.phases)
+        self.lock    = threading.Lock()
+
+    def count(self, counter, n=1):
+        with self.lock:
+            self.counts[counter] += n
+
+    def observe(self, phase, seconds):
+        with self.lock:
+            self.latency[phase].observe(seconds)
+
+    def outcome(self, result):
+        if isinstance(result, BugNotFoundError):
+            self.count('notfound')
+        elif isinstance(result, Exception):
+            self.count('errors')
+        else:
+            self.count('found')
+
+    def call(self, func, *args):
+        """Call func(*args), a get_bug or get_bugs of the tracker, timing it
+        and counting the bugs it found or did not"""
+        lookup_timing.fetch = 0.0
+        start = time.time()
+        try:
+            result = func(*args)
+        except Exception as e:
+            self.observe('fetch', lookup_timing.fetch)
+            self.outcome(e)
+            raise
+        self.observe('fetch', lookup_timing.fetch)
+        self.observe('parse', max(0.0, time.time() - start - lookup_timing.fetch))
+        for bugdata in (result.values() if isinstance(result, dict) else (result,)):
+            self.outcome(bugdata)
+        return result
+
+    def snapshot(self):
+        """Copies of the counters, and of the histograms by phase"""
+        with self.lock:
+            latency = {}
+            for (phase, histogram) in self.latency.items():
+                latency[phase] = copy = Histogram()
+                copy.counts = list(histogram.counts)
+                copy.sum = histogram.sum
+                copy.count = histogram.count
+            return (Counter(self.counts), latency)
+
+class ForgeHosts:
+    """Hosts of self-hosted forges we found the type of, kept in a file so
+    that they survive restarts. Hosts that turned out to be of no type we
+    know, or could not be probed, are remembered for a while too, so that
+    we do not probe them every time they are mentioned."""
+    def __init__(self, filename):
+        self.filename = filename
+        self.types    = {} # host: trackertype
+        self.failed   = {} # host: time until which not to probe it again
+        self.lock     = threading.Lock()
+        try:
+            with open(filename) as fd:
+                data = json.load(fd)
+            self.types = data['types']
+            self.failed = data['failed']
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            supylog.warning("Bugtracker: Could not read %s: %s" % (filename, e))
+
+    def get(self, host):
+        """The trackertype of host, '' if a probe of it failed recently,
+        or None if it needs probing"""
+        with self.lock:
+            if host in self.types:
+                return self.types[host]
+            if self.failed.get(host, 0) > time.time():
+                return ''
+
+    def put(self, host, trackertype, ttl=0):
+        """Remember the trackertype of host, or for ttl seconds that it
+        has none we know"""
+        now = time.time()
+        with self.lock:
+            if trackertype:
+                self.types[host] = trackertype
+                self.failed.pop(host, None)
+            else:
+                self.failed[host] = now + ttl
+            self.failed = dict((h, t) for (h, t) in self.failed.items() if t > now)
+            try:
+                fd = utils.file.AtomicFile(self.filename)
+                json.dump({'types': self.types, 'failed': self.failed}, fd)
+                fd.close()
+            except OSError as e:
+                supylog.warning("Bugtracker: Could not write %s: %s" % (self.filename, e))
+
+def parse_bugids(text, limit):
+    """Bug numbers in a list like "1, 5-8 #12", in order and without
+    duplicates. Raises ValueError if text is not such a list, or has more
+    than limit bugs in it."""
+    bugids = OrderedDict()
+    for part in re.split(r'[,\s]+', re.sub(r'\s*-\s*', '-', text.strip())):
+        if not part:
+            continue
+        match = re.match(r'#?(\d+)(?:-#?(\d+))?$', part)
+        if not match:
+            raise ValueError("'%s' is not a bug number or range" % part)
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        if last < first:
+            raise ValueError("'%s' is not a bug number or range" % part)
+        for bugid in range(first, last + 1):
+            bugids[bugid] = None
+            if len(bugids) > limit:
+                raise ValueError('At most %d bugs can be looked up at once' % limit)
+    if not bugids:
+        raise ValueError('No bug numbers given')
+    return list(bugids)
+
+def format_stats(tracker):
+    """One line summary of the stats of a tracker"""
+    (counts, latency) = tracker.stats.snapshot()
+    report = '%s: %d lookups (%d cached, %d stale, %d coalesced), %d found, %d not found, %d errors, ' \
+             '%d unavailable, %d suppressed' % (tracker.name, counts['lookups'], counts['cached'], counts['stale'],
+                                               counts['coalesced'], counts['found'], counts['notfound'],
+                                               counts['errors'], counts['unavailable'], counts['suppressed'])
+    for phase in TrackerStats.phases:
+        if latency[phase].count:
+            report += ', %s p50 %dms p95 %dms' % (phase, latency[phase].quantile(0.5) * 1000,
+                                                 latency[phase].quantile(0.95) * 1000)
+    if tracker.health.state != TrackerHealth.CLOSED:
+        report += ' [%s]' % tracker.health.state
+    return report
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_metrics(trackers):
+    """The stats of trackers in the Prometheus text format"""
+    lines = []
+    def metric(name, kind, help, samples):
+        lines.append('# HELP bugtracker_%s %s' % (name, help))
+        lines.append('# TYPE bugtracker_%s %s' % (name, kind))
+        for (suffix, labels, value) in samples:
+            labels = ','.join('%s="%s"' % (k, _label(str(v))) for (k, v) in labels)
+            lines.append('bugtracker_%s%s{%s} %s' % (name, suffix, labels, value))
+    stats = [(tracker.name, tracker.stats.snapshot()) for tracker in trackers]
+    metric('lookups_total', 'counter', 'Bugs looked up, including those found in the cache.',
+           [('', [('tracker', name)], counts['lookups']) for (name, (counts, latency)) in stats])
+    metric('cache_hits_total', 'counter', 'Lookups answered from the cache, by whether the bug had expired.',
+           [('', [('tracker', name), ('state', state)], counts[counter]) for (name, (counts, latency)) in stats
+            for (state, counter) in (('fresh', 'cached'), ('stale', 'stale'))])
+    metric('coalesced_total', 'counter', 'Lookups that waited for the same lookup already underway.',
+           [('', [('tracker', name)], counts['coalesced']) for (name, (counts, latency)) in stats])
+    metric('results_total', 'counter', 'Bugs the tracker was asked for, by result.',
+           [('', [('tracker', name), ('result', result)], counts[counter]) for (name, (counts, latency)) in stats
+            for (result, counter) in (('found', 'found'), ('notfound', 'notfound'), ('error', 'errors'))])
+    metric('unavailable_total', 'counter', 'Lookups not made because the tracker was considered unavailable.',
+           [('', [('tracker', name)], counts['unavailable']) for (name, (counts, latency)) in stats])
+    metric('suppressed_total', 'counter', 'Bugs not shown because they were shown recently.',
+           [('', [('tracker', name)], counts['suppressed']) for (name, (counts, latency)) in stats])
+    samples = []
+    for (name, (counts, latency)) in stats:
+        for phase in TrackerStats.phases:
+            histogram = latency[phase]
+            cumulative = 0
+            for (bound, count) in zip(Histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += count
+                samples.append(('_bucket', [('tracker', name), ('phase', phase), ('le', bound)], cumulative))
+            samples.append(('_sum', [('tracker', name), ('phase', phase)], repr(histogram.sum)))
+            samples.append(('_count', [('tracker', name), ('phase', phase)], histogram.count))
+    metric('duration_seconds', 'histogram', 'Time spent fetching and parsing bugs, and formatting replies.', samples)
+    metric('available', 'gauge', 'Whether the tracker is considered available.',
+           [('', [('tracker', tracker.name)], int(tracker.health.state != TrackerHealth.OPEN)) for tracker in trackers])
+    return '\n'.join(lines) + '\n'
+
+# Every snarfer needs a digit somewhere, except for OOPS IDs
+snarfcheck = re.compile(r'\d|OOPS-', re.I)
 cvere = re.compile(r'<th[^>]*>Description</th>.*?<td[^>]*>\s*(?P<cve>.*?)\s*</td>', re.I | re.DOTALL)
 cverre = re.compile(r'<h2[^>]*>\s*(?P<cverr>.*?)\s*</h2>', re.I | re.DOTALL)
 class Bugtracker(callbacks.PluginRegexp):
     """Show a link to a bug report with a brief description"""
     threaded = True
     callBefore = ('URL')
-    regexps = ('turlSnarfer', 'bugSnarfer', 'cveSnarfer', 'oopsSnarfer')
+    regexps = ('snarfer',)
+    # Most general last, where matches overlap the first one wins
+    snarfers = ('turlSnarfer', 'cveSnarfer', 'oopsSnarfer', 'bugSnarfer')
 
     def __init__(self, irc):
         self.__parent = super(Bugtracker, self)
         self.__parent.__init__(irc)
+        self.snarfres = dict((name, re.compile(getattr(self, name).__doc__, self.flags)) for name in self.snarfers)
         self.db = ircutils.IrcDict()
+        self.index = TrackerIndex()
+        self.shorthand = Abbreviations()
+        # Commands and the snarfers change trackers from different threads
+        self.trackers_lock = threading.RLock()
         for name in self.registryValue('bugtrackers'):
             registerBugtracker(name)
             group = self.registryValue('bugtrackers.%s' % name.replace('.','\\.'), value=False)
             if group.trackertype() in defined_bugtrackers:
-                self.db[name] = defined_bugtrackers[group.trackertype()](name, group.url(), group.description(), group.trackertype())
+                self.add_tracker(defined_bugtrackers[group.trackertype()](name, group.url(), group.description(), group.trackertype()))
             else:
                 supylog.warning("Bugtracker: Unknown trackertype: %s (%s)" % (group.trackertype(), name))
-        self.shorthand = utils.abbrev(list(self.db.keys()))
-        self.shown = {}
+        self.shown = expiry.ExpiryDict()
+        self.cache = BugCache()
+        self.inflight = InFlight()
+        self.popular = Popularity()
+        self.refreshing = set()
+        self.refreshing_lock = threading.Lock()
+        self.forges = ForgeHosts(conf.supybot.directories.data.dirize('Bugtracker-forges.json'))
+        self.probes = InFlight()
+        self.lookups = futures.ThreadPoolExecutor(max_workers=self.registryValue('lookupThreads'))
+        httppool.pool.maxPerHost = self.registryValue('connectionsPerHost')
+        self.cvedb = None
+        self.cvedb_lock = threading.Lock()
+        self.hot_event = schedule.addPeriodicEvent(self.refresh_hot, self.registryValue('hotBugsInterval'),
+                                                   'Bugtracker hot bugs', now=False)
+        self.metrics_event = None
+        if self.registryValue('metricsInterval'):
+            self.metrics_event = schedule.addPeriodicEvent(self.write_metrics, self.registryValue('metricsInterval'),
+                                                           'Bugtracker metrics', now=False)
+
+    def die(self):
+        with self.refreshing_lock:
+            for name in self.refreshing:
+                try:
+                    schedule.removeEvent(name)
+                except KeyError:
+                    pass
+        for event in (self.hot_event, self.metrics_event):
+            if not event:
+                continue
+            try:
+                schedule.removePeriodicEvent(event)
+            except KeyError:
+                pass
+        self.lookups.shutdown(wait=False)
+        httppool.pool.close()
+        if self.cvedb:
+            self.cvedb.close()
+        self.__parent.die()
+
+    def get_cvedb(self):
+        """The local CVE database, if it is enabled"""
+        if not self.registryValue('cveDatabase'):
+            return None
+        with self.cvedb_lock:
+            if not self.cvedb:
+                self.cvedb = cvedb.CVEDatabase(conf.supybot.directories.data.dirize('Bugtracker-CVE.db'))
+            return self.cvedb
+
+    def write_metrics(self):
+        """Write the stats of all trackers to the data directory, in the
+        Prometheus text format, for the node exporter's textfile collector
+        or anything else that understands it"""
+        filename = conf.supybot.directories.data.dirize('Bugtracker-metrics.prom')
+        try:
+            fd = utils.file.AtomicFile(filename)
+            fd.write(format_metrics([t for t in self.db.values() if t.stats.counts]))
+            fd.close()
+        except OSError as e:
+            supylog.warning("Bugtracker: Could not write %s: %s" % (filename, e))
+
+    def add_tracker(self, tracker):
+        with self.trackers_lock:
+            if tracker.name in self.db:
+                self.index.remove(self.db[tracker.name])
+                self.shorthand.remove(self.db[tracker.name].name)
+            self.db[tracker.name] = tracker
+            self.index.add(tracker)
+            self.shorthand.add(tracker.name)
+
+    def remove_tracker(self, name):
+        with self.trackers_lock:
+            tracker = self.db[name]
+            self.index.remove(tracker)
+            self.shorthand.remove(tracker.name)
+            del self.db[name]
 
-    def is_ok(self, channel, tracker, bug):
-        """Flood/repeat protection"""
-        now = time.time()
-        for k in list(self.shown.keys()):
-            if self.shown[k] < now - self.registryValue('repeatdelay', channel):
-                self.shown.pop(k)
-        if (channel, tracker, bug) not in self.shown:
-            self.shown[(channel, tracker, bug)] = now
+    def is_ok(self, channel, tracker, bug, force=False):
+        """Flood/repeat protection. Marks bug as shown, so only call this
+        when replying about it. Bugs explicitly asked for are always shown
+        (force), but still count as shown for the snarfers."""
+        if self.shown.add((channel, tracker, bug), time.time(), self.registryValue('repeatdelay', channel)) \
+                or force:
+            return True
+        if isinstance(tracker, IBugtracker):
+            tracker.stats.count('suppressed')
+        return False
+
+    def recently_shown(self, channel, tracker, bug):
+        """Whether the snarfers need not look bug up, as it was shown not
+        long ago"""
+        if (channel, tracker, bug) in self.shown:
+            tracker.stats.count('suppressed')
             return True
         return False
 
@@ -164,12 +990,11 @@ class Bugtracker(callbacks.PluginRegexp):
             url = url[:-1]
         trackertype = trackertype.lower()
         if trackertype in defined_bugtrackers:
-            self.db[name] = defined_bugtrackers[trackertype](name, url, description, trackertype)
+            self.add_tracker(defined_bugtrackers[trackertype](name, url, description, trackertype))
         else:
             irc.error("Bugtrackers of type '%s' are not understood" % trackertype)
             return
         registerBugtracker(name, url, description, trackertype)
-        self.shorthand = utils.abbrev(list(self.db.keys()))
         irc.replySuccess()
     add = wrap(add, [('checkCapability', 'admin'), 'something', 'something', 'url', additional('text')])
 
@@ -181,9 +1006,8 @@ class Bugtracker(callbacks.PluginRegexp):
         """
         try:
             name = self.shorthand[name.lower()]
-            del self.db[name]
+            self.remove_tracker(name)
             self.registryValue('bugtrackers').remove(name)
-            self.shorthand = utils.abbrev(list(self.db.keys()))
             irc.replySuccess()
         except KeyError:
             s = self.registryValue('replyNoBugtracker', msg.args[0] if ircutils.isChannel(msg.args[0]) else None)
@@ -201,11 +1025,12 @@ class Bugtracker(callbacks.PluginRegexp):
             d = group.description()
             if newdesc:
                 d = newdesc
-            self.db[newname] = defined_bugtrackers[group.trackertype()](name, group.url(), d)
+            tracker = defined_bugtrackers[group.trackertype()](newname, group.url(), d, group.trackertype())
+            with self.trackers_lock:
+                self.remove_tracker(name)
+                self.add_tracker(tracker)
             registerBugtracker(newname, group.url(), d, group.trackertype())
-            del self.db[name]
             self.registryValue('bugtrackers').remove(name)
-            self.shorthand = utils.abbrev(list(self.db.keys()))
             irc.replySuccess()
         except KeyError:
             s = self.registryValue('replyNoBugtracker', msg.args[0] if ircutils.isChannel(msg.args[0]) else None)
@@ -237,17 +1062,141 @@ class Bugtracker(callbacks.PluginRegexp):
                 irc.reply('I have no defined bugtrackers.')
     list = wrap(list, [additional('text')])
 
+    def cveimport(self, irc, msg, args, path):
+        """<file|directory>
+
+        Import CVE descriptions into the local CVE database from a JSON feed
+        file, gzipped or not, or from all JSON files under a directory. NVD
+        1.1 feeds, NVD 2.0 API responses and CVE JSON 5 records are
+        understood. Records we already have a newer version of are skipped,
+        so delta files can be imported on top of a full import.
+        """
+        db = self.get_cvedb()
+        if not db:
+            irc.error("'supybot.plugins.Bugtracker.cveDatabase' is not enabled")
+            return
+        try:
+            count = db.import_path(path)
+        except Exception as e:
+            irc.error('Could not import CVE data from %s: %s' % (path, e))
+            return
+        irc.replySuccess('%d CVE records read' % count)
+    cveimport = wrap(cveimport, [('checkCapability', 'owner'), 'text'])
+
+    def stats(self, irc, msg, args, name):
+        """[abbreviation]
+
+        Show how many bugs were looked up on each bugtracker, how many of
+        those came from the cache or failed, how many were not shown again
+        because they were shown recently, and how long fetching, parsing
+        and formatting them took. If [abbreviation] is specified, only show
+        that bugtracker.
+        """
+        if name:
+            try:
+                trackers = [self.db[self.shorthand[name.lower()]]]
+            except KeyError:
+                s = self.registryValue('replyNoBugtracker', msg.args[0] if ircutils.isChannel(msg.args[0]) else None)
+                irc.error(s % name)
+                return
+        else:
+            trackers = [t for t in self.db.values() if t.stats.counts]
+            trackers.sort(key=lambda t: t.stats.counts['lookups'], reverse=True)
+        if not trackers:
+            irc.reply('No bugs have been looked up yet.')
+            return
+        irc.reply('; '.join(format_stats(t) for t in trackers))
+    stats = wrap(stats, [('checkCapability', 'admin'), additional('text')])
+
+    def bug(self, irc, msg, args, text):
+        """[<tracker>] <bug numbers>
+
+        Look up bugs on <tracker>, or on the default bugtracker. Bug numbers
+        are separated by commas or spaces, and ranges such as 100-120 may be
+        given, up to supybot.plugins.Bugtracker.maxBugs bugs in all. Bugs
+        are shown even if they were shown recently.
+        """
+        channel = msg.args[0] if ircutils.isChannel(msg.args[0]) else None
+        (name, rest) = (text.split(None, 1) + [''])[:2]
+        if re.match(r'#?\d', name):
+            name = self.registryValue('snarfTarget', channel)
+            rest = text
+        try:
+            tracker = self.db[self.shorthand[name.lower()]]
+        except KeyError:
+            s = self.registryValue('replyNoBugtracker', channel)
+            irc.error(s % name)
+            return
+        try:
+            bugids = parse_bugids(rest, self.registryValue('maxBugs'))
+        except ValueError as e:
+            irc.error(str(e))
+            return
+
+        # Leave the other half of the lookup threads to the snarfers, and
+        # give up on what is not done in time all at once
+        target = channel or msg.nick
+        lookups = self.lookup_bugs(tracker, bugids, urgent=True,
+                                   threads=max(1, self.registryValue('lookupThreads') // 2))
+        (done, pending) = futures.wait(lookups, self.registryValue('lookupTimeout'))
+        for lookup in pending:
+            lookup.cancel()
+        reports = []
+        errors = set()
+        timedout = []
+        for (bugid, lookup) in zip(bugids, lookups):
+            if lookup not in done:
+                timedout.append(str(bugid))
+                continue
+            try:
+                bugdata = lookup.result()
+            except BugNotFoundError:
+                self.is_ok(target, tracker, bugid, force=True)
+                reports.append("Could not find %s bug %d" % (tracker.description, bugid))
+            except BugtrackerError as e:
+                self.is_ok(target, tracker, bugid, force=True)
+                # Say that a tracker is unavailable only once
+                if str(e) not in errors:
+                    errors.add(str(e))
+                    reports.append(str(e))
+            else:
+                # Shown even if it was shown recently, but counts as shown
+                if bugdata:
+                    reports.append(self.show_bug(target, tracker, bugid, bugdata,
+                                                 self.registryValue('showassignee', channel),
+                                                 self.registryValue('extended', channel), force=True))
+        if timedout:
+            reports.append("Timed out getting %s %s %s" % (tracker.description, 'bugs' if len(timedout) > 1 else 'bug',
+                                                           ', '.join(timedout)))
+        # A single reply, so that long lists are split up for 'more'
+        if reports:
+            irc.reply(' | '.join(reports))
+    bug = wrap(bug, ['text'])
+
     def inFilter(self, irc, msg):
-        if not msg.prefix:
+        # Messages from unregistered users are dropped before doPrivmsg
+        # when defaultIgnore is on, so snarf them here
+        if not msg.prefix or msg.command != 'PRIVMSG' or not conf.supybot.defaultIgnore():
             return msg
-        if not defaultIgnored(msg.prefix, msg.args[0]):
+        (user, ignored) = usercache.resolve(msg)
+        if not defaultIgnored(user, msg.args[0]):
             return msg
-        if checkIgnored(msg.prefix, msg.args[0]):
+        if ignored:
             return msg
-        if msg.command == 'PRIVMSG':
-            self.doPrivmsg(irc, msg)
+        self.doPrivmsg(irc, msg)
         return msg
 
+    def doPrivmsg(self, irc, msg):
+        if not snarfcheck.search(msg.args[1]):
+            return
+        self.__parent.doPrivmsg(irc, msg)
+
+    def snarfer(self, irc, msg, match):
+        # Matches for all snarfers in one pass, its pattern is set below
+        # the class. Hand the match over to the snarfer it is for.
+        name = match.lastgroup
+        getattr(self, name)(irc, msg, self.snarfres[name].match(msg.args[1], match.start()))
+
     def bugSnarfer(self, irc, msg, match):
         r"(?P<bt>[a-z][^\s:]*(\s+bugs?)?):*\s+#?(?P<bug>\d+(?!\d*[-.]\d+)(\s*([,\s]+|[,\s]*(and|und|en|et|ir|[&+]+))\s*#?\d+(?!\d*[-.]\d+))*)"
         channel = msg.args[0] if ircutils.isChannel(msg.args[0]) else None
@@ -271,7 +1220,7 @@ class Bugtracker(callbacks.PluginRegexp):
         bt = [x.lower() for x in match.group('bt').split()]
         sure_bug = bt[-1] in ('bug', 'bugs')
 
-        bugids = list(set(bugids)) # remove dupes
+        bugids = list(dict.fromkeys(bugids)) # remove dupes, keeping order
 
         if not sure_bug:
             bugids = [x for x in bugids if int(x) > 100]
@@ -307,19 +1256,33 @@ class Bugtracker(callbacks.PluginRegexp):
                 irc.error(s % name)
                 return
 
-        for bugid in bugids:
-            bugid = int(bugid)
+        # Look all bugs up at once, but reply in the order they were given
+        target = channel or msg.nick
+        bugids = [int(x) for x in bugids if not self.recently_shown(target, tracker, int(x))]
+        lookups = self.lookup_bugs(tracker, bugids)
+        deadline = time.time() + min(self.registryValue('lookupTimeout'),
+                                     self.registryValue('connectTimeout') + tracker.health.timeout())
+        errors = set()
+        for (bugid, lookup) in zip(bugids, lookups):
             try:
-                report = self.get_bug(channel or msg.nick, tracker, bugid, self.registryValue('showassignee', channel),
-                                      self.registryValue('extended', channel), do_tracker=showTracker)
+                bugdata = lookup.result(max(0, deadline - time.time()))
+            except futures.TimeoutError:
+                # Not shown, so the next mention looks it up again
+                irc.error("Timed out getting %s bug %d" % (tracker.description, bugid))
             except BugNotFoundError:
-                if self.registryValue('replyWhenNotFound'):
+                if self.registryValue('replyWhenNotFound') and self.is_ok(target, tracker, bugid):
                     irc.error("Could not find %s bug %d" % (tracker.description, bugid))
             except BugtrackerError as e:
                 if not sure_bug and bugid < 30:
                     return
-                irc.error(str(e))
+                # Say that a tracker is unavailable only once
+                if self.is_ok(target, tracker, bugid) and str(e) not in errors:
+                    errors.add(str(e))
+                    irc.error(str(e))
             else:
+                report = bugdata and self.show_bug(target, tracker, bugid, bugdata,
+                                                   self.registryValue('showassignee', channel),
+                                                   self.registryValue('extended', channel), do_tracker=showTracker)
                 if report:
                     irc.reply(report)
 
@@ -340,14 +1303,20 @@ class Bugtracker(callbacks.PluginRegexp):
             url = url[url.rfind('://')+3:]
         try:
             tracker = self.get_tracker(url, bugid)
-            if not tracker:
-                return
-            report = self.get_bug(channel or msg.nick, tracker, bugid, self.registryValue('showassignee', channel),
-                                  self.registryValue('extended', channel), do_url=False)
         except BugtrackerError as e:
             irc.error(str(e))
+            return
+        if not tracker:
+            return
+        target = channel or msg.nick
+        try:
+            report = self.get_bug(target, tracker, bugid, self.registryValue('showassignee', channel),
+                                  self.registryValue('extended', channel), do_url=False)
+        except BugtrackerError as e:
+            if self.is_ok(target, tracker, bugid):
+                irc.error(str(e))
         except BugNotFoundError:
-            if self.registryValue('replyWhenNotFound'):
+            if self.registryValue('replyWhenNotFound') and self.is_ok(target, tracker, bugid):
                 irc.error("Could not find %s bug %s" % (tracker.description, match.group('bug')))
         else:
             if report:
@@ -378,23 +1347,28 @@ class Bugtracker(callbacks.PluginRegexp):
         if not self.is_ok(channel or msg.nick, 'cve', cveid):
             return
         url = 'https://cve.mitre.org/cgi-bin/cvename.cgi?name=CVE-%s' % cveid
-        try:
-            cvedata = utils.web.getUrl(url).decode('utf-8')
-        except Exception as e:
-            raise BugtrackerError('Could not get CVE data: %s (%s)' % (e, url))
-        m = cvere.search(cvedata)
-        if m:
+        cve = None
+        db = self.get_cvedb()
+        if db:
+            cve = db.get('CVE-%s' % cveid)
+        if not cve:
+            try:
+                cvedata = fetch_url(url).decode('utf-8')
+            except Exception as e:
+                raise BugtrackerError('Could not get CVE data: %s (%s)' % (e, url))
+            m = cvere.search(cvedata)
+            if not m:
+                m = cverre.search(cvedata)
+                if m:
+                    cverr = utils.web.htmlToText(m.group('cverr'), tagReplace='')
+                    irc.reply(cverr)
+                return
             cve = utils.web.htmlToText(m.group('cve'), tagReplace='')
-            if len(cve) > 380:
-                cve = cve[:380] + '...'
-            if not match.group(1):
-                cve += ' <%s>' % url
-            irc.reply(cve)
-        else:
-            m = cverre.search(cvedata)
-            if m:
-                cverr = utils.web.htmlToText(m.group('cverr'), tagReplace='')
-                irc.reply(cverr)
+        if len(cve) > 380:
+            cve = cve[:380] + '...'
+        if not match.group(1):
+            cve += ' <%s>' % url
+        irc.reply(cve)
 
     #TODO: As we will depend on launchpadlib, we should consider using lazr.uri.URI to do URL parsing
     def get_tracker(self, snarfurl, bugid):
@@ -404,14 +1378,9 @@ class Bugtracker(callbacks.PluginRegexp):
         # Launchpad URL shortening
         snarfurl = re.sub(r'pad\.lv/(bug=)?(?P<bug>[0-9]+)', r'launchpad.net/bugs/\g<bug>', snarfurl)
 
-        for t in list(self.db.keys()):
-            tracker = self.db.get(t, None)
-            if not tracker:
-                supylog.error("No tracker for key '%s'" % t)
-                continue
-            url = tracker.url[tracker.url.rfind('://')+3:]
-            if url in snarfurl:
-                return tracker
+        tracker = self.index.find(snarfurl)
+        if tracker:
+            return tracker
 
         # No tracker found, bummer. Let's try and get one
         if 'show_bug.cgi' in snarfurl:
@@ -421,9 +1390,7 @@ class Bugtracker(callbacks.PluginRegexp):
         elif 'github.com' in snarfurl:
             tracker = GitHub().get_tracker(snarfurl)
         elif re.match(r'[^\s/]+/[^\s/]+/[^\s/]+/(issues|pulls|merge_requests)', snarfurl):
-            tracker = GitLab().get_tracker(snarfurl, bugid)
-            if not tracker:
-                tracker = Gitea().get_tracker(snarfurl, bugid)
+            tracker = self.get_forge_tracker(snarfurl, bugid)
         elif 'view.php' in snarfurl:
             tracker = Mantis().get_tracker(snarfurl)
         elif '/ticket/' in snarfurl:
@@ -432,22 +1399,250 @@ class Bugtracker(callbacks.PluginRegexp):
             return
 
         if tracker:
-            self.db[tracker.name] = tracker
-            self.shorthand = utils.abbrev(list(self.db.keys()))
+            self.add_tracker(tracker)
             return tracker
 
+    def get_forge_tracker(self, snarfurl, bugid):
+        """Tracker for a GitLab or Gitea URL. Which of the two a host runs
+        is found by probing it, at most once per host at a time."""
+        host = snarfurl.split('/', 1)[0].lower()
+        trackertype = self.forges.get(host)
+        if trackertype is None:
+            (future, leader) = self.probes.claim(host)
+            if leader:
+                try:
+                    trackertype = self.probe_forge(host, snarfurl, bugid)
+                finally:
+                    self.probes.finish(host, trackertype)
+            else:
+                trackertype = future.result()
+        if trackertype == 'gitlab':
+            return GitLab().get_tracker(snarfurl, bugid, probe=False)
+        elif trackertype == 'gitea':
+            return Gitea().get_tracker(snarfurl, bugid, probe=False)
+
+    def probe_forge(self, host, snarfurl, bugid):
+        """Find out whether host runs GitLab or Gitea from the version
+        endpoint of their APIs, and remember it. Returns its trackertype,
+        or '' if it runs neither or we could not tell."""
+        try:
+            for cls in (GitLab, Gitea):
+                tracker = cls().get_tracker(snarfurl, bugid)
+                if tracker:
+                    self.forges.put(host, tracker.trackertype)
+                    return tracker.trackertype
+        except BugtrackerError as e:
+            # Only a short while, as it may just be down for now
+            supylog.info('Bugtracker: %s' % e)
+            self.forges.put(host, '', self.registryValue('probeErrorTTL'))
+            return ''
+        self.forges.put(host, '', self.registryValue('probeCacheTTL'))
+        return ''
+
+    def fetch_bug(self, tracker, id, refresh=False):
+        """Get bug data from the tracker, or from the cache if we have
+        looked it up recently. If the bug is being looked up already, wait
+        for that lookup instead. Popular bugs that expired not long ago are
+        served from the cache too, while they are refreshed in the
+        background."""
+        key = (tracker.url, id)
+        if not refresh:
+            tracker.stats.count('lookups')
+            self.popular.mention(key, tracker)
+            cached = self.cache.get(key)
+            if cached:
+                tracker.stats.count('cached')
+                (bugdata, error) = cached
+                if error:
+                    raise error.__class__(*error.args)
+                return bugdata
+            if self.popular.is_hot(key):
+                bugdata = self.cache.get_stale(key)
+                if bugdata:
+                    tracker.stats.count('stale')
+                    self.schedule_refresh(tracker, id)
+                    return bugdata
+        (future, leader) = self.inflight.claim(key)
+        if not leader:
+            tracker.stats.count('coalesced')
+            return self.inflight.wait(future)
+        try:
+            bugdata = tracker.health.call(tracker, tracker.stats.call, tracker.get_bug, id)
+        except Exception as e:
+            # Rather keep serving what we have than an error while refreshing
+            if isinstance(e, BugNotFoundError) or (isinstance(e, BugtrackerError) and not refresh):
+                self.cache.put(key, error=e)
+            self.inflight.finish(key, error=e)
+            self.defer(tracker, id, e)
+            raise
+        if bugdata:
+            self.cache.put(key, bugdata)
+        self.inflight.finish(key, bugdata)
+        return bugdata
+
+    def fetch_bugs(self, tracker, ids):
+        """Like fetch_bug, for several bugs at once. Returns a dict mapping
+        each id to its bug data, or to the error raised looking it up."""
+        bugs = {}
+        missing = []
+        waiting = {}
+        tracker.stats.count('lookups', len(ids))
+        for id in ids:
+            self.popular.mention((tracker.url, id), tracker)
+            cached = self.cache.get((tracker.url, id))
+            if cached:
+                tracker.stats.count('cached')
+                (bugdata, error) = cached
+                bugs[id] = error.__class__(*error.args) if error else bugdata
+                continue
+            if self.popular.is_hot((tracker.url, id)):
+                bugdata = self.cache.get_stale((tracker.url, id))
+                if bugdata:
+                    tracker.stats.count('stale')
+                    self.schedule_refresh(tracker, id)
+                    bugs[id] = bugdata
+                    continue
+            (future, leader) = self.inflight.claim((tracker.url, id))
+            if leader:
+                missing.append(id)
+            else:
+                tracker.stats.count('coalesced')
+                waiting[id] = future
+        if missing:
+            try:
+                fetched = tracker.health.call(tracker, tracker.stats.call, tracker.get_bugs, missing)
+            except Exception as e:
+                for id in missing:
+                    if isinstance(e, BugtrackerError):
+                        self.cache.put((tracker.url, id), error=e)
+                    self.inflight.finish((tracker.url, id), error=e)
+                    self.defer(tracker, id, e)
+                raise
+            for id in missing:
+                bugdata = fetched.get(id)
+                if isinstance(bugdata, (BugNotFoundError, BugtrackerError)):
+                    self.cache.put((tracker.url, id), error=bugdata)
+                    self.inflight.finish((tracker.url, id), error=bugdata)
+                    self.defer(tracker, id, bugdata)
+                else:
+                    if bugdata:
+                        self.cache.put((tracker.url, id), bugdata)
+                    self.inflight.finish((tracker.url, id), bugdata)
+                bugs[id] = bugdata
+        for (id, future) in waiting.items():
+            try:
+                bugs[id] = self.inflight.wait(future)
+            except (BugNotFoundError, BugtrackerError) as e:
+                bugs[id] = e
+        return bugs
+
+    def schedule_refresh(self, tracker, id, when=None):
+        """Look a bug up again in the background, now or at time when,
+        unless that is already underway"""
+        name = 'Bugtracker refresh %s %d' % (tracker.url, id)
+        with self.refreshing_lock:
+            if name in self.refreshing:
+                return
+            self.refreshing.add(name)
+        def refresh():
+            try:
+                self.fetch_bug(tracker, id, refresh=True)
+            except (BugNotFoundError, BugtrackerError):
+                pass
+            finally:
+                with self.refreshing_lock:
+                    self.refreshing.discard(name)
+        def start():
+            try:
+                self.lookups.submit(refresh)
+            except RuntimeError: # Unloaded meanwhile
+                pass
+        schedule.addEvent(start, when or time.time(), name)
+
+    def refresh_hot(self):
+        """Look the hot bugs that expire before we are run again up in the
+        background, so that they are still answered from the cache"""
+        until = time.time() + self.registryValue('hotBugsInterval')
+        for (key, tracker) in self.popular.hot_bugs():
+            expires = self.cache.expires(key)
+            if expires and expires <= until:
+                self.schedule_refresh(tracker, key[1])
+
+    def defer(self, tracker, id, error):
+        """If a bug could not be looked up because of the tracker's rate
+        limit, look it up once the limit is reset, so that its next mention
+        can be answered from the cache"""
+        limited = error.__context__
+        if isinstance(limited, RateLimited) and limited.reset > time.time():
+            self.schedule_refresh(tracker, id, limited.reset)
+
+    def lookup_bugs(self, tracker, ids, urgent=False, threads=None):
+        """Start looking bugs up in the background, in a single request if
+        the tracker supports it, and otherwise one after the other on at
+        most threads of the lookup threads, one per bug by default. Returns
+        a future of the bug data for each id, which can be cancelled while
+        it has not been started. Urgent lookups are those explicitly asked
+        for, which may use up all of a rate limited API's budget."""
+        lookups = [(id, futures.Future()) for id in ids]
+        def run(group):
+            lookup_priority.urgent = urgent
+            try:
+                if tracker.batched and len(group) > 1:
+                    group = [(id, future) for (id, future) in group if future.set_running_or_notify_cancel()]
+                    try:
+                        bugs = self.fetch_bugs(tracker, [id for (id, future) in group])
+                    except Exception as e:
+                        bugs = dict((id, e) for (id, future) in group)
+                    for (id, future) in group:
+                        bugdata = bugs.get(id)
+                        if isinstance(bugdata, Exception):
+                            future.set_exception(bugdata)
+                        else:
+                            future.set_result(bugdata)
+                    return
+                for (id, future) in group:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        future.set_result(self.fetch_bug(tracker, id))
+                    except Exception as e:
+                        future.set_exception(e)
+            finally:
+                lookup_priority.urgent = False
+
+        if tracker.batched:
+            groups = [lookups]
+        else:
+            # Every n-th bug in the same group, so the first ones come first
+            n = min(len(lookups), threads or len(lookups))
+            groups = [lookups[i::n] for i in range(n)]
+        for group in groups:
+            if group:
+                self.lookups.submit(run, group)
+        return [future for (id, future) in lookups]
+
     def get_bug(self, channel, tracker, id, do_assignee, do_extinfo, do_url=True, do_tracker=True):
-        if not self.is_ok(channel, tracker, id):
+        if self.recently_shown(channel, tracker, id):
             return
 
-        bugdata = tracker.get_bug(id)
+        bugdata = self.fetch_bug(tracker, id)
         if not bugdata:
             return
+        return self.show_bug(channel, tracker, id, bugdata, do_assignee, do_extinfo, do_url, do_tracker)
 
-        (bid, product, title, severity, status, assignee, url, extinfo, duplicate) = bugdata
-
-        if duplicate and not self.is_ok(channel, tracker, bid):
+    def show_bug(self, channel, tracker, id, bugdata, do_assignee, do_extinfo, do_url=True, do_tracker=True,
+                 force=False):
+        """The report on bug id, unless it or the bug it is a duplicate of
+        was shown recently. Both count as shown from now on."""
+        if not self.is_ok(channel, tracker, id, force):
+            return
+        if bugdata.duplicate and not self.is_ok(channel, tracker, bugdata.id, force):
             return
+        return self.format_bug(channel, tracker, bugdata, do_assignee, do_extinfo, do_url, do_tracker)
+
+    def format_bug(self, channel, tracker, bugdata, do_assignee, do_extinfo, do_url=True, do_tracker=True):
+        start = time.time()
+        (bid, product, title, severity, status, assignee, url, extinfo, duplicate) = bugdata
 
         bugtype = re.match(r'.*/(feature-)?(?P<type>request|patch|todo|issue|pull|merge|ticket)(_requests)?(e?s)?/[0-9]+/?$', url)
         if do_tracker and tracker.trackertype not in ('github', 'gitlab', 'gitea'):
@@ -497,10 +1692,17 @@ class Bugtracker(callbacks.PluginRegexp):
             report_title_cut = report_title[:title_max].rsplit(None, 1)[0] + '...'
             report = '%s"%s"%s' % (report_start, report_title_cut, report_end)
 
+        tracker.stats.observe('format', time.time() - start)
         return report
 
+Bugtracker.snarfer.__doc__ = '|'.join('(?P<%s>%s)' % (name, re.sub(r'\(\?P<\w+>', '(?:', getattr(Bugtracker, name).__doc__))
+                                      for name in Bugtracker.snarfers)
+
 # Define all bugtrackers
 class IBugtracker:
+    batched     = False # Whether get_bugs needs a single request
+    ratelimited = False # Whether the API limits how many requests we make
+
     def __init__(self, name=None, url=None, description=None, trackertype=None):
         self.name        = name
         self.url         = url
@@ -508,10 +1710,93 @@ class IBugtracker:
         self.trackertype = trackertype
         self.errget      = 'Could not get data from %s: %s (%s)'
         self.errparse    = 'Could not parse data from %s: %s (%s)'
+        self.health      = TrackerHealth()
+        self.stats       = TrackerStats()
+
+    def fetch(self, url, headers=None, data=None):
+        return self.request(url, headers, data).check().data
+
+    def stream(self, url, headers=None):
+        return stream_url(url, headers, self.health.timeout())
+
+    def request(self, url, headers=None, data=None):
+        if not self.ratelimited:
+            return request_url(url, headers, data, self.health.timeout())
+        host = urlsplit(url).netloc.lower()
+        token = api_token(host)
+        if token:
+            headers = dict(headers or {})
+            headers.update(self.auth_headers(token))
+        ratelimits.acquire(host)
+        response = request_url(url, headers, data, self.health.timeout())
+        if ratelimits.update(host, response):
+            raise RateLimited('Rate limit of %s exceeded' % host, ratelimits.reset(host))
+        return response
+
+    def auth_headers(self, token):
+        """Headers to authenticate to the API with token"""
+        return {'Authorization': 'token %s' % token}
+
+    def probe_json(self, url):
+        """Whether url answers with JSON, as the API of a forge would, even
+        if it wants us to authenticate first. Raises BugtrackerError if the
+        host did not answer or had an error, as then we cannot tell."""
+        try:
+            response = self.request(url)
+        except Exception as e:
+            raise BugtrackerError('Could not probe %s: %s' % (url, e))
+        if response.status >= 500 or response.status == 429:
+            raise BugtrackerError('Could not probe %s: HTTP Error %d: %s' % (url, response.status, response.reason))
+        if response.status >= 400 and response.status not in (401, 403):
+            return False
+        try:
+            json.loads(response.data.decode('utf-8'))
+        except ValueError:
+            return False
+        return True
+
+    def fetch_json(self, url, parse, headers=None):
+        """Get JSON from url and return the bug record parse() makes of it.
+        If we have seen url before, only ask for it again if it has changed
+        since, and otherwise return the record parsed then."""
+        headers = dict(headers or {})
+        stored = validators.get(url)
+        if stored:
+            (etag, modified, record) = stored
+            if etag:
+                headers['If-None-Match'] = etag
+            if modified:
+                headers['If-Modified-Since'] = modified
+        try:
+            response = self.request(url, headers)
+            if stored and response.status == 304:
+                return record
+            bug = json.loads(response.check().data.decode('utf-8'))
+        except Exception as e:
+            raise BugtrackerError(self.errget % (self.description, e, url))
+        record = parse(bug)
+        etag = response.headers.get('ETag')
+        modified = response.headers.get('Last-Modified')
+        if etag or modified:
+            validators.put(url, etag, modified, record)
+        return record
 
     def get_bug(self, id):
         raise BugTrackerError("Bugtracker class does not implement get_bug")
 
+    def get_bugs(self, ids):
+        """Get several bugs at once. Returns a dict mapping each id to its
+        bug data, or to the BugNotFoundError or BugtrackerError raised
+        looking it up. Raises BugtrackerError if the tracker could not be
+        asked at all."""
+        bugs = {}
+        for id in ids:
+            try:
+                bugs[id] = self.get_bug(id)
+            except (BugNotFoundError, BugtrackerError) as e:
+                bugs[id] = e
+        return bugs
+
     def get_tracker(self, url):
         raise BugTrackerError("Bugtracker class does not implement get_tracker")
 
@@ -538,91 +1823,254 @@ class Bugzilla(IBugtracker):
         except:
             pass
 
+    batched = True
+    # Only what Bugtracker.get_bug shows, 'assigned_to' includes its details
+    fields = 'id,product,summary,severity,status,resolution,assigned_to'
+
     def get_bug(self, id):
-        url = "%s/rest/bug/%d" % (self.url, id)
+        url = "%s/rest/bug/%d?include_fields=%s" % (self.url, id, self.fields)
         try:
-            bugjson = utils.web.getUrl(url)
+            bugjson = self.fetch(url)
             bug = json.loads(bugjson.decode('utf-8'))['bugs'][0]
         except Exception as e:
             # For old-stable Bugzilla
             if 'HTTP Error 404' in str(e):
                 return self.get_bug_old(id)
             raise BugtrackerError(self.errget % (self.description, e, url))
+        return self.parse_bug(id, bug, url)
+
+    def get_bugs(self, ids):
+        url = "%s/rest/bug?id=%s&include_fields=%s&permissive=1" % (self.url, ','.join(map(str, ids)), self.fields)
+        try:
+            bugjson = self.fetch(url)
+            data = json.loads(bugjson.decode('utf-8'))
+        except Exception as e:
+            # For old-stable Bugzilla, or one that failed the whole request for a missing bug
+            if 'HTTP Error 404' in str(e):
+                return IBugtracker.get_bugs(self, ids)
+            raise BugtrackerError(self.errget % (self.description, e, url))
+        bugs = {}
+        for bug in data.get('bugs', []):
+            try:
+                bugs[bug['id']] = self.parse_bug(bug['id'], bug, url)
+            except BugtrackerError as e:
+                bugs[bug['id']] = e
+        for fault in data.get('faults', []):
+            if fault.get('faultCode') == 101:
+                bugs[fault['id']] = BugNotFoundError()
+            else:
+                bugs[fault['id']] = BugtrackerError('Error getting %s bug #%d: %s'
+                                                    % (self.description, fault['id'], fault.get('faultString')))
+        for id in ids:
+            if id not in bugs:
+                bugs[id] = BugNotFoundError()
+        return bugs
+
+    def parse_bug(self, id, bug, url):
         try:
             status = bug['status']
             if bug['resolution']:
                 status += ': %s' % bug['resolution']
-            if bug['assigned_to_detail']:
+            if bug.get('assigned_to_detail'):
                 assignee = bug['assigned_to_detail']['real_name']
                 if not assignee:
                     assignee = bug['assigned_to_detail']['name']
             else:
                 assignee = ''
-            return (id, bug['product'], bug['summary'], bug['severity'], status, assignee,
-                    "%s/show_bug.cgi?id=%d" % (self.url, id), [], [])
+            return BugRecord(id, bug['product'], bug['summary'], bug['severity'], status, assignee,
+                             "%s/show_bug.cgi?id=%d" % (self.url, id))
         except Exception as e:
             raise BugtrackerError(self.errparse % (self.description, e, url))
 
+    old_fields = ('short_desc', 'bug_status', 'resolution', 'product', 'bug_severity', 'assigned_to')
+
     def get_bug_old(self, id): # Deprecated
-        url = "%s/show_bug.cgi?id=%d&ctype=xml" % (self.url, id)
+        # Comments and attachments are not needed, so ask for them not to be
+        # sent, and stop reading when they come anyway
+        url = "%s/show_bug.cgi?id=%d&ctype=xml&excludefield=long_desc&excludefield=attachmentdata" % (self.url, id)
+        parser = ElementTree.XMLPullParser(('start', 'end'))
+        bug_n = None
+        fields = {}
+        done = False
+        chunks = self.stream(url)
         try:
-            bugxml = utils.web.getUrl(url)
-            zilladom = minidom.parseString(bugxml)
+            for chunk in chunks:
+                parser.feed(chunk)
+                for (event, elem) in parser.read_events():
+                    if event == 'start':
+                        if elem.tag == 'bug':
+                            bug_n = elem
+                        elif elem.tag in ('long_desc', 'attachment'):
+                            done = True
+                    elif elem.tag == 'bug':
+                        done = True
+                    elif elem.tag in self.old_fields:
+                        fields.setdefault(elem.tag, elem)
+                if done or len(fields) == len(self.old_fields):
+                    break
+        except ElementTree.ParseError as e:
+            raise BugtrackerError(self.errparse % (self.description, e, url))
         except Exception as e:
             raise BugtrackerError(self.errget % (self.description, e, url))
-        bug_n = zilladom.getElementsByTagName('bug')[0]
-        if bug_n.hasAttribute('error'):
-            errtxt = bug_n.getAttribute('error')
+        finally:
+            chunks.close()
+        if bug_n is None:
+            raise BugtrackerError(self.errparse % (self.description, 'No bug found', url))
+        if bug_n.get('error'):
+            errtxt = bug_n.get('error')
             if errtxt == 'NotFound':
                 raise BugNotFoundError
             s = 'Error getting %s bug #%d: %s' % (self.description, id, errtxt)
             raise BugtrackerError(s)
         try:
-            title = _getnodetxt(bug_n.getElementsByTagName('short_desc')[0])
-            status = _getnodetxt(bug_n.getElementsByTagName('bug_status')[0])
+            title = _getnodetxt(fields['short_desc'])
+            status = _getnodetxt(fields['bug_status'])
             try:
-                status = "%s: %s" % (status, _getnodetxt(bug_n.getElementsByTagName('resolution')[0]))
+                status = "%s: %s" % (status, _getnodetxt(fields['resolution']))
             except:
                 pass
-            product = _getnodetxt(bug_n.getElementsByTagName('product')[0])
-            severity = _getnodetxt(bug_n.getElementsByTagName('bug_severity')[0])
+            product = _getnodetxt(fields['product'])
+            severity = _getnodetxt(fields['bug_severity'])
             try:
-                assignee = _getnodeattr(bug_n.getElementsByTagName('assigned_to')[0], 'name')
+                assignee = _getnodeattr(fields['assigned_to'], 'name')
             except:
                 try:
-                    assignee = _getnodetxt(bug_n.getElementsByTagName('assigned_to')[0])
+                    assignee = _getnodetxt(fields['assigned_to'])
                 except:
                     assignee = ''
         except Exception as e:
             raise BugtrackerError(self.errparse % (self.description, e, url))
-        return (id, product, title, severity, status, assignee, "%s/show_bug.cgi?id=%d" % (self.url, id), [], [])
+        return BugRecord(id, product, title, severity, status, assignee, "%s/show_bug.cgi?id=%d" % (self.url, id))
+
+class SoapEndpoint:
+    """SOAP clients of an endpoint, one per thread as pysimplesoap clients
+    must not be used by several threads at once, each created when first
+    called"""
+    def __init__(self, location, namespace):
+        self.location  = location
+        self.namespace = namespace
+        self.local     = threading.local()
+
+    def get_client(self):
+        client = getattr(self.local, 'client', None)
+        if not client:
+            client = self.local.client = SoapClient(self.location, namespace=self.namespace,
+                                                    timeout=conf.supybot.plugins.Bugtracker.readTimeout())
+        return client
+
+    def __getattr__(self, name):
+        def method(*args, **kwargs):
+            client = self.get_client()
+            start = time.time()
+            try:
+                return getattr(client, name)(*args, **kwargs)
+            finally:
+                add_fetch_time(start)
+        return method
+
+class SoapEndpoints:
+    """SOAP endpoints shared by all trackers using them"""
+    def __init__(self):
+        self.endpoints = {}
+        self.lock = threading.Lock()
+
+    def get(self, location, namespace):
+        with self.lock:
+            try:
+                return self.endpoints[(location, namespace)]
+            except KeyError:
+                endpoint = self.endpoints[(location, namespace)] = SoapEndpoint(location, namespace)
+                return endpoint
+
+soap_endpoints = SoapEndpoints()
+
+class LaunchpadClient:
+    """Launchpad API clients for the Launchpad trackers, one per thread, as
+    launchpadlib connections must not be used by several threads at once.
+    Logging in first fetches the API description, which can take a while,
+    so that is done in the background on first use, and again after a
+    login failed. Later logins use the cached description."""
+    retry = 300 # Seconds to wait after a failed login
+
+    def __init__(self):
+        self.local   = threading.local()
+        self.ready   = False
+        self.thread  = None
+        self.failed  = 0
+        self.missing = False
+        self.lock    = threading.Lock()
+
+    def connect(self):
+        from launchpadlib.launchpad import Launchpad
+        cachedir = os.path.join(conf.supybot.directories.data.tmp(), 'launchpadlib')
+        return Launchpad.login_anonymously("Ubuntu Bots - Bugtracker", 'production', cachedir, version='devel')
+
+    def get(self):
+        """Return the client of the calling thread, logging it in if we
+        have logged in before. Otherwise start logging in if we are not
+        already, and return None."""
+        lp = getattr(self.local, 'lp', None)
+        if lp:
+            return lp
+        with self.lock:
+            if not self.ready:
+                if not self.missing and not self.thread and self.failed + self.retry <= time.time():
+                    self.thread = threading.Thread(target=self.login, name='Bugtracker Launchpad login')
+                    self.thread.daemon = True
+                    self.thread.start()
+                return None
+        try:
+            lp = self.local.lp = self.connect()
+        except Exception:
+            supylog.exception("Unknown exception while accessing the Launchpad API")
+            with self.lock:
+                self.ready = False
+                self.failed = time.time()
+        return lp
+
+    def login(self):
+        ready = False
+        try:
+            self.connect()
+            ready = True
+        except ImportError:
+            supylog.warning("Please install python-launchpadlib, the old interface is deprecated")
+            self.missing = True
+        except Exception:
+            supylog.exception("Unknown exception while accessing the Launchpad API")
+        with self.lock:
+            self.ready = ready
+            if not ready:
+                self.failed = time.time()
+            self.thread = None
+
+    def reset(self, lp):
+        """Drop the client of the calling thread after it failed, so that
+        it logs in again"""
+        if getattr(self.local, 'lp', None) is lp:
+            self.local.lp = None
+
+launchpad = LaunchpadClient()
 
 class Launchpad(IBugtracker):
     statuses = ("Unknown", "Invalid", "Opinion", "Won't Fix", "Fix Released", "Fix Committed", "New",
                 "Incomplete", "Confirmed", "Triaged", "In Progress")
     severities = ("Unknown", "Undecided", "Wishlist", "Low", "Medium", "High", "Critical")
+    task_limit = 300 # Most tasks the API returns in a single page
+    duplicate_ttl = 86400
 
     def __init__(self, *args, **kwargs):
         IBugtracker.__init__(self, *args, **kwargs)
-        self.lp = None
+        # Bugs we found to be duplicates: (duplicate ids, id of the bug they are duplicates of)
+        self.duplicates = expiry.ExpiryDict()
 
-        # A word to the wise:
-        # The Launchpad API is much better than the /+text interface we currently use,
-        # it's faster and easier to get the information we need.
-        # The current /+text interface is not really maintained by Launchpad and most,
-        # or all, of the Launchpad developers hate it. For this reason, we are dropping
-        # support for /+text in the future in favour of launchpadlib.
-        # Terence Simpson (tsimpson) 2010-04-20
-
-        try:
-            from launchpadlib.launchpad import Launchpad
-            cachedir = os.path.join(conf.supybot.directories.data.tmp(), 'launchpadlib')
-            self.lp = Launchpad.login_anonymously("Ubuntu Bots - Bugtracker", 'production', cachedir, version='devel')
-        except ImportError:
-            supylog.warning("Please install python-launchpadlib, the old interface is deprecated")
-        except Exception:
-            self.lp = None
-            supylog.exception("Unknown exception while accessing the Launchpad API")
+    # A word to the wise:
+    # The Launchpad API is much better than the /+text interface we currently use,
+    # it's faster and easier to get the information we need.
+    # The current /+text interface is not really maintained by Launchpad and most,
+    # or all, of the Launchpad developers hate it. For this reason, we are dropping
+    # support for /+text in the future in favour of launchpadlib.
+    # Terence Simpson (tsimpson) 2010-04-20
 
     def _parse(self, task): # Deprecated
         parser = FeedParser()
@@ -678,30 +2126,40 @@ class Launchpad(IBugtracker):
         return 0
 
     def get_bug(self, id): #TODO: Remove this method and rename 'get_bug_new' to 'get_bug'
-        if self.lp:
-            return self.get_bug_new(id)
+        lp = launchpad.get()
+        if lp:
+            # launchpadlib fetches as attributes are read, so all of it
+            # counts as waiting for Launchpad
+            start = time.time()
+            try:
+                return self.get_bug_new(id, lp)
+            finally:
+                add_fetch_time(start)
         return self.get_bug_old(id)
 
-    def get_bug_new(self, id): #TODO: Rename this method to 'get_bug'
+    def get_bug_new(self, id, lp): #TODO: Rename this method to 'get_bug'
         try:
-            bugdata = self.lp.bugs[id]
+            # Every bug of a duplicate chain takes a request, so skip the
+            # ones we have been through before
+            (duplicate, target) = self.duplicates.get(id, ((), id))
+            duplicate = list(duplicate)
+            bugdata = lp.bugs[target]
             if bugdata.private:
                 raise BugtrackerError("This bug is private")
-            duplicate = []
             dup = bugdata.duplicate_of
             while dup:
                 duplicate.append(str(bugdata.id))
                 bugdata = dup
                 dup = bugdata.duplicate_of
+            if duplicate:
+                self.duplicates.set(id, (tuple(duplicate), bugdata.id), self.duplicate_ttl)
 
             extinfo = ['affected: %d' % bugdata.users_affected_count_with_dupes]
             extinfo.append('heat: %d' % bugdata.heat)
-            tasks = bugdata.bug_tasks
 
-            if tasks.total_size > 1:
-                taskdata = sorted(tasks, key=self._rank)[-1]
-            else:
-                taskdata = tasks[0]
+            # Slicing gets the tasks in a single page, rather than one
+            # request for the size of the collection and more for its pages
+            taskdata = sorted(bugdata.bug_tasks[:self.task_limit], key=self._rank)[-1]
 
             if taskdata.assignee:
                 assignee = taskdata.assignee.display_name
@@ -718,14 +2176,17 @@ class Launchpad(IBugtracker):
                 raise BugtrackerError(self.errget % (self.description, e, '%s/bugs/%d' % (self.url, id)))
             elif isinstance(e, KeyError):
                 raise BugNotFoundError
+            elif isinstance(e, OSError) or type(e).__module__.startswith('httplib2'):
+                # Not an answer from the API, so log in again in case the client is broken
+                launchpad.reset(lp)
             raise BugtrackerError(self.errget % (self.description, e, '%s/bugs/%d' % (self.url, id)))
 
-        return (bugdata.id, taskdata.bug_target_display_name, bugdata.title, taskdata.importance, taskdata.status,
-                assignee, "%s/bugs/%d" % (self.url, bugdata.id), extinfo, duplicate)
+        return BugRecord(bugdata.id, taskdata.bug_target_display_name, bugdata.title, taskdata.importance, taskdata.status,
+                         assignee, "%s/bugs/%d" % (self.url, bugdata.id), extinfo, duplicate)
 
     def get_bug_old(self, id, duplicate=None): # Deprecated
         try:
-            bugdata = utils.web.getUrl("%s/bugs/%d/+text" % (self.url, id)).decode('utf-8')
+            bugdata = self.fetch("%s/bugs/%d/+text" % (self.url, id)).decode('utf-8')
         except Exception as e:
             if 'HTTP Error 404' in str(e):
                 if duplicate:
@@ -754,11 +2215,10 @@ class Launchpad(IBugtracker):
         # Try and find duplicates
         if bugdata['duplicate-of']:
             data = self.get_bug_old(int(bugdata['duplicate-of']), duplicate or id)
-            data[8].append(bugdata['bug'])
-            return data
+            return data._replace(duplicate=data.duplicate + (bugdata['bug'],))
 
-        return (id, taskdata['task'], bugdata['title'], taskdata['importance'], taskdata['status'],
-                assignee, "%s/bugs/%d" % (self.url, id), [], [])
+        return BugRecord(id, taskdata['task'], bugdata['title'], taskdata['importance'], taskdata['status'],
+                         assignee, "%s/bugs/%d" % (self.url, id))
 
 # <rant>
 # Debbugs sucks donkeyballs
@@ -771,9 +2231,11 @@ class Launchpad(IBugtracker):
 # Fortunately bugs.donarmstrong.com has a SOAP interface which we can use.
 # </rant>
 class Debbugs(IBugtracker):
-    def __init__(self, *args, **kwargs):
-        IBugtracker.__init__(self, *args, **kwargs)
-        self.soap_client = SoapClient("%s/cgi-bin/soap.cgi" % self.url, namespace="Debbugs/SOAP")
+    batched = True
+
+    @property
+    def soap_client(self):
+        return soap_endpoints.get("%s/cgi-bin/soap.cgi" % self.url, "Debbugs/SOAP")
 
     def get_bug(self, id):
         url = "%s/cgi-bin/bugreport.cgi?bug=%d" % (self.url, id)
@@ -783,13 +2245,51 @@ class Debbugs(IBugtracker):
             raise BugtrackerError(self.errget % (self.description, e, url))
         if not hasattr(raw, 'item'):
             raise BugNotFoundError
+        return self.parse_bug(id, raw.item.value, url)
+
+    def get_bugs(self, ids):
+        url = "%s/cgi-bin/bugreport.cgi?bug=%s" % (self.url, ','.join(map(str, ids)))
+        # get_status wants a SOAP array of bug numbers, which pysimplesoap
+        # can't marshall by itself, so build the request by hand
+        request = SimpleXMLElement('<get_status></get_status>')
+        bugs = request.add_child('bugs')
+        bugs.add_attribute('xmlns:soapenc', 'http://schemas.xmlsoap.org/soap/encoding/')
+        bugs.add_attribute('xsi:type', 'soapenc:Array')
+        bugs.add_attribute('soapenc:arrayType', 'xsd:int[%d]' % len(ids))
+        for id in ids:
+            bugs.add_child('item', str(id)).add_attribute('xsi:type', 'xsd:int')
+        try:
+            raw = self.soap_client.call('get_status', request)
+        except Exception as e:
+            raise BugtrackerError(self.errget % (self.description, e, url))
+        bugs = {}
         try:
-            raw = raw.item.value
-            if str(raw.fixed_versions):
+            # <get_statusResponse><s-gensym3><item><key/><value/></item>...
+            items = raw('get_statusResponse').children()[0].children() or []
+        except Exception:
+            items = []
+        for item in items:
+            try:
+                id = int(item.key)
+            except Exception:
+                continue
+            try:
+                bugs[id] = self.parse_bug(id, item.value, url)
+            except BugtrackerError as e:
+                bugs[id] = e
+        for id in ids:
+            if id not in bugs:
+                bugs[id] = BugNotFoundError()
+        return bugs
+
+    def parse_bug(self, id, raw, url):
+        try:
+            # A SOAP array of versions, or a single one
+            if raw.fixed_versions.children() or str(raw.fixed_versions):
                 status = 'Fixed'
             else:
                 status = 'Open'
-            return (id, str(raw.package), str(raw.subject), str(raw.severity), status, '', "%s/%d" % (self.url, id), [], [])
+            return BugRecord(id, str(raw.package), str(raw.subject), str(raw.severity), status, '', "%s/%d" % (self.url, id))
         except Exception as e:
             raise BugtrackerError(self.errparse % (self.description, e, url))
 
@@ -807,7 +2307,7 @@ class SourceForge(IBugtracker):
     def get_bug(self, id):
         url = "%s/%d/" % (self.url.replace('sourceforge.net', 'sourceforge.net/rest'), id)
         try:
-            bugjson = utils.web.getUrl(url)
+            bugjson = self.fetch(url)
             bug = json.loads(bugjson.decode('utf-8'))['ticket']
         except Exception as e:
             raise BugtrackerError(self.errget % (self.description, e, url))
@@ -817,12 +2317,14 @@ class SourceForge(IBugtracker):
                 product = bug['labels'][0]
             if '_priority' in bug['custom_fields']:
                 severity = 'Pri: %s' % bug['custom_fields']['_priority']
-            return (id, product, bug['summary'], severity, ': '.join(bug['status'].split('-')),
-                     bug['assigned_to'], "%s/%d/" % (self.url, id), [], [])
+            return BugRecord(id, product, bug['summary'], severity, ': '.join(bug['status'].split('-')),
+                             bug['assigned_to'], "%s/%d/" % (self.url, id))
         except Exception as e:
             raise BugtrackerError(self.errparse % (self.description, e, url))
 
 class GitHub(IBugtracker):
+    ratelimited = True
+
     def get_tracker(self, url):
         try:
             match = re.match(r'github\.com/[^\s/]+/[^\s/]+/(issues|pulls?)', url)
@@ -839,11 +2341,9 @@ class GitHub(IBugtracker):
         url = "%s/%d" % (self.url.replace('github.com', 'api.github.com/repos'), id)
         # Pulls are inconsistent in web and API URLs
         url = url.replace('/pull/', '/pulls/')
-        try:
-            bugjson = utils.web.getUrl(url)
-            bug = json.loads(bugjson.decode('utf-8'))
-        except Exception as e:
-            raise BugtrackerError(self.errget % (self.description, e, url))
+        return self.fetch_json(url, lambda bug: self.parse_bug(id, bug, url))
+
+    def parse_bug(self, id, bug, url):
         try:
             product = '/'.join(url.split('/')[-4:-2])
             if 'merged' in bug and bug['merged']:
@@ -854,31 +2354,35 @@ class GitHub(IBugtracker):
                 assignee = bug['assignee']['login']
             else:
                 assignee = ''
-            return (id, product, bug['title'], '', status, assignee, bug['html_url'], [], [])
+            return BugRecord(id, product, bug['title'], '', status, assignee, bug['html_url'])
         except Exception as e:
             raise BugtrackerError(self.errparse % (self.description, e, url))
 
 class GitLab(IBugtracker):
-    def get_tracker(self, url, id):
-        try:
-            match = re.match(r'[^\s/]+/[^\s/]+/[^\s/]+/(issues|merge_requests)', url)
-            name  = desc = match.group(0)
-            url   = 'https://%s' % name
-            bugurl = '%s/%d.json' % (url, id)
-            bugjson = utils.web.getUrl(bugurl)
-            bug   = json.loads(bugjson.decode('utf-8'))
-#            registerBugtracker(name, url, desc, 'gitlab')
-            return GitLab(name, url, desc, 'gitlab')
-        except:
-            pass
+    ratelimited = True
+
+    def auth_headers(self, token):
+        return {'PRIVATE-TOKEN': token}
+
+    def get_tracker(self, url, id, probe=True):
+        """With probe, only if the host turns out to run GitLab. Raises
+        BugtrackerError if the host could not tell us. The API of the host
+        is probed rather than bug id, which may just be missing."""
+        match = re.match(r'[^\s/]+/[^\s/]+/[^\s/]+/(issues|merge_requests)', url)
+        if not match:
+            return
+        name  = desc = match.group(0)
+        url   = 'https://%s' % name
+        if probe and not self.probe_json('https://%s/api/v4/version' % name.split('/')[0]):
+            return
+#        registerBugtracker(name, url, desc, 'gitlab')
+        return GitLab(name, url, desc, 'gitlab')
 
     def get_bug(self, id):
         url = "%s/%d.json" % (self.url, id)
-        try:
-            bugjson = utils.web.getUrl(url)
-            bug = json.loads(bugjson.decode('utf-8'))
-        except Exception as e:
-            raise BugtrackerError(self.errget % (self.description, e, url))
+        return self.fetch_json(url, lambda bug: self.parse_bug(id, bug, url))
+
+    def parse_bug(self, id, bug, url):
         try:
             product = '/'.join(url.split('/')[-4:-2])
             status = bug['state']
@@ -886,31 +2390,32 @@ class GitLab(IBugtracker):
                 assignee = bug['assignees'][0]['name']
             else:
                 assignee = ''
-            return (id, product, bug['title'], '', status, assignee, "%s/%d" % (self.url, id), [], [])
+            return BugRecord(id, product, bug['title'], '', status, assignee, "%s/%d" % (self.url, id))
         except Exception as e:
             raise BugtrackerError(self.errparse % (self.description, e, url))
 
 class Gitea(IBugtracker):
-    def get_tracker(self, url, id):
-        try:
-            match = re.match(r'[^\s/]+/[^\s/]+/[^\s/]+/(issues|pulls)', url)
-            name  = desc = match.group(0)
-            url   = 'https://%s' % name
-            bugurl = '%s/%d' % (re.sub(r'://[^\s/]+/', r'\g<0>api/v1/repos/', url), id)
-            bugjson = utils.web.getUrl(bugurl)
-            bug   = json.loads(bugjson.decode('utf-8'))
-#            registerBugtracker(name, url, desc, 'gitea')
-            return Gitea(name, url, desc, 'gitea')
-        except:
-            pass
+    ratelimited = True
+
+    def get_tracker(self, url, id, probe=True):
+        """With probe, only if the host turns out to run Gitea. Raises
+        BugtrackerError if the host could not tell us. The API of the host
+        is probed rather than bug id, which may just be missing."""
+        match = re.match(r'[^\s/]+/[^\s/]+/[^\s/]+/(issues|pulls)', url)
+        if not match:
+            return
+        name  = desc = match.group(0)
+        url   = 'https://%s' % name
+        if probe and not self.probe_json('https://%s/api/v1/version' % name.split('/')[0]):
+            return
+#        registerBugtracker(name, url, desc, 'gitea')
+        return Gitea(name, url, desc, 'gitea')
 
     def get_bug(self, id):
         url = "%s/%d" % (re.sub(r'://[^\s/]+/', r'\g<0>api/v1/repos/', self.url), id)
-        try:
-            bugjson = utils.web.getUrl(url)
-            bug = json.loads(bugjson.decode('utf-8'))
-        except Exception as e:
-            raise BugtrackerError(self.errget % (self.description, e, url))
+        return self.fetch_json(url, lambda bug: self.parse_bug(id, bug, url))
+
+    def parse_bug(self, id, bug, url):
         try:
             product = '/'.join(url.split('/')[-4:-2])
             if 'merged' in bug and bug['merged']:
@@ -922,14 +2427,14 @@ class Gitea(IBugtracker):
             else:
                 assignee = ''
             # Issues have no 'html_url', but pulls do
-            return (id, product, bug['title'], '', status, assignee, "%s/%d" % (self.url, id), [], [])
+            return BugRecord(id, product, bug['title'], '', status, assignee, "%s/%d" % (self.url, id))
         except Exception as e:
             raise BugtrackerError(self.errparse % (self.description, e, url))
 
 class Mantis(IBugtracker):
-    def __init__(self, *args, **kwargs):
-        IBugtracker.__init__(self, *args, **kwargs)
-        self.soap_client = SoapClient("%s/api/soap/mantisconnect.php" % self.url, namespace="http://futureware.biz/mantisconnect")
+    @property
+    def soap_client(self):
+        return soap_endpoints.get("%s/api/soap/mantisconnect.php" % self.url, "http://futureware.biz/mantisconnect")
 
     def get_tracker(self, url):
         try:
@@ -944,7 +2449,7 @@ class Mantis(IBugtracker):
     def get_bug(self, id):
         url = "%s/api/rest/issues/%d" % (self.url, id)
         try:
-            bugjson = utils.web.getUrl(url)
+            bugjson = self.fetch(url)
             bug = json.loads(bugjson.decode('utf-8'))['issues'][0]
         except Exception as e:
             # REST API may not be enabled yet
@@ -952,7 +2457,7 @@ class Mantis(IBugtracker):
                 return self.get_bug_old(id)
             raise BugtrackerError(self.errget % (self.description, e, url))
         try:
-            return (id, bug['project']['name'], bug['summary'], bug['severity']['name'], bug['resolution']['name'], '', url, [], [])
+            return BugRecord(id, bug['project']['name'], bug['summary'], bug['severity']['name'], bug['resolution']['name'], '', url)
         except Exception as e:
             raise BugtrackerError(self.errparse % (self.description, e, url))
 
@@ -971,7 +2476,7 @@ class Mantis(IBugtracker):
         if not hasattr(raw, 'id'):
             raise BugNotFoundError
         try:
-            return (id, str(raw.project.name), str(raw.summary), str(raw.severity.name), str(raw.resolution.name), '', url, [], [])
+            return BugRecord(id, str(raw.project.name), str(raw.summary), str(raw.severity.name), str(raw.resolution.name), '', url)
         except Exception as e:
             raise BugtrackerError(self.errparse % (self.description, e, url))
 
@@ -993,7 +2498,7 @@ class Trac(IBugtracker):
     def get_bug(self, id): # This is still a little rough, but it works :)
         url = "%s/%d" % (self.url, id)
         try:
-            raw = utils.web.getUrl("%s?format=tab" % url).decode('utf-8')
+            raw = self.fetch("%s?format=tab" % url).decode('utf-8')
         except Exception as e:
             # Due to unreliable matching
             if '.' in self.name:
@@ -1020,7 +2525,7 @@ class Trac(IBugtracker):
             severity = rest[headers.index("priority")]
         if "owner" in headers:
             assignee = rest[headers.index("owner")]
-        return (id, package, title, severity, status, assignee, url, [], [])
+        return BugRecord(id, package, title, severity, status, assignee, url)
 
 # Introspection is quite cool
 defined_bugtrackers = {}
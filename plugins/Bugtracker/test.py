@@ -13,5 +13,695 @@
 #
 ###
 from supybot.test import *
-class BugtrackerTestCase(PluginTestCase):
+import supybot.schedule as schedule
+
+import os, re, gzip, json, time, tempfile, threading
+from imp import reload
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from . import plugin
+from ubottu_common import expiry, usercache
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests.append((self.path, self.headers))
+        route = self.server.routes.get(self.path.split('?')[0])
+        if route:
+            (status, headers, body) = route(self)
+        else:
+            (status, headers, body) = (404, {}, b'Not found')
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, format, *args):
+        pass
+
+class StubServer:
+    """A local HTTP server answering the paths in routes, each of which
+    maps to a function of the request returning (status, headers, body)"""
+    def __init__(self, routes):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.routes = routes
+        self.server.requests = []
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def issue(id, title='Title', state='opened'):
+    return {'title': '%s %d' % (title, id), 'state': state, 'assignees': []}
+
+class BugtrackerTestCase(ChannelPluginTestCase):
     plugins = ('Bugtracker',)
+    config = {'supybot.plugins.Bugtracker.bugSnarfer': True,
+              'supybot.plugins.Bugtracker.oopsSnarfer': True,
+              'supybot.plugins.Bugtracker.replyWhenNotFound': True}
+
+    def setUp(self):
+        ChannelPluginTestCase.setUp(self)
+        self.cb = self.irc.getCallback('Bugtracker')
+        self.stubs = []
+
+    def tearDown(self):
+        for stub in self.stubs:
+            stub.close()
+        ChannelPluginTestCase.tearDown(self)
+
+    def stub(self, routes):
+        stub = StubServer(routes)
+        self.stubs.append(stub)
+        return stub
+
+    def tracker(self, name, trackertype, url):
+        self.assertNotError('bugtracker add %s %s %s' % (name, trackertype, url))
+        return self.cb.db[name]
+
+    def testCacheTTL(self):
+        stub = self.stub({'/group/project/issues/5.json': lambda r: (200, {}, issue(5)),
+                          '/group/project/issues/7.json': lambda r: (500, {}, b'Internal error'),
+                          '/group/project/issues/8.json': lambda r: (500, {}, b'Internal error'),
+                          '/rest/bug': lambda r: (200, {}, {'bugs': []})})
+        tracker = self.tracker('lab', 'gitlab', stub.url + '/group/project/issues')
+        self.assertEqual(self.cb.fetch_bug(tracker, 5).title, 'Title 5')
+        self.assertEqual(self.cb.fetch_bug(tracker, 5).title, 'Title 5')
+        self.assertEqual(len(stub.requests), 1)
+        self.assertEqual(tracker.stats.counts['cached'], 1)
+        # Errors are cached too, for their own TTL
+        self.assertRaises(plugin.BugtrackerError, self.cb.fetch_bug, tracker, 7)
+        self.assertRaises(plugin.BugtrackerError, self.cb.fetch_bug, tracker, 7)
+        self.assertEqual(len(stub.requests), 2)
+        with conf.supybot.plugins.Bugtracker.cacheErrorTTL.context(0):
+            self.assertRaises(plugin.BugtrackerError, self.cb.fetch_bug, tracker, 8)
+            self.assertRaises(plugin.BugtrackerError, self.cb.fetch_bug, tracker, 8)
+        self.assertEqual(len(stub.requests), 4)
+        # And so are missing bugs
+        zilla = self.tracker('zilla', 'bugzilla', stub.url)
+        self.assertIsInstance(self.cb.fetch_bugs(zilla, [1, 2])[1], plugin.BugNotFoundError)
+        self.assertIsInstance(self.cb.fetch_bugs(zilla, [1, 2])[2], plugin.BugNotFoundError)
+        self.assertEqual(len(stub.requests), 5)
+        # Bugs are looked up again once they expire
+        with conf.supybot.plugins.Bugtracker.cacheTTL.context(1), \
+             conf.supybot.plugins.Bugtracker.cacheStaleTTL.context(0):
+            self.cb.cache.clear()
+            self.cb.fetch_bug(tracker, 5)
+            self.cb.fetch_bug(tracker, 5)
+            self.assertEqual(len(stub.requests), 6)
+            time.sleep(1.1)
+            self.cb.fetch_bug(tracker, 5)
+            self.assertEqual(len(stub.requests), 7)
+
+    def testStaleWhileRevalidate(self):
+        stub = self.stub({'/group/project/issues/5.json': lambda r: (200, {}, issue(5)),
+                          '/group/project/issues/6.json': lambda r: (200, {}, issue(6))})
+        tracker = self.tracker('lab', 'gitlab', stub.url + '/group/project/issues')
+        def refreshed(count):
+            for i in range(50):
+                schedule.run()
+                if len(stub.requests) >= count and not self.cb.refreshing:
+                    break
+                time.sleep(0.1)
+            self.assertEqual(len(stub.requests), count)
+        with conf.supybot.plugins.Bugtracker.cacheTTL.context(1), \
+             conf.supybot.plugins.Bugtracker.hotBugMentions.context(3):
+            self.cb.fetch_bug(tracker, 5)
+            self.cb.fetch_bug(tracker, 6)
+            self.cb.fetch_bug(tracker, 5)
+            self.assertFalse(self.cb.popular.is_hot((tracker.url, 5)))
+            self.cb.fetch_bug(tracker, 5)
+            self.assertTrue(self.cb.popular.is_hot((tracker.url, 5)))
+            time.sleep(1.1)
+            # Hot bugs that expired are shown while they are looked up again
+            self.assertEqual(self.cb.fetch_bug(tracker, 5).title, 'Title 5')
+            self.assertEqual(tracker.stats.counts['stale'], 1)
+            self.assertEqual(len(stub.requests), 2)
+            refreshed(3)
+            self.assertEqual(self.cb.fetch_bug(tracker, 5).title, 'Title 5')
+            self.assertEqual(tracker.stats.counts['cached'], 3)
+            # Others are looked up right away
+            self.cb.fetch_bug(tracker, 6)
+            self.assertEqual(len(stub.requests), 4)
+            # Hot bugs about to expire are refreshed ahead of time
+            self.cb.refresh_hot()
+            refreshed(5)
+            self.assertEqual(stub.requests[-1][0], '/group/project/issues/5.json')
+
+    def testHotBugs(self):
+        popular = plugin.Popularity()
+        with conf.supybot.plugins.Bugtracker.hotBugs.context(2), \
+             conf.supybot.plugins.Bugtracker.hotBugMentions.context(2):
+            for key in ('a', 'a', 'b', 'b', 'c', 'c'):
+                popular.mention(key, None)
+            self.assertEqual(sorted(key for (key, tracker) in popular.hot_bugs()), ['a', 'b'])
+            # A bug mentioned more often displaces the coolest hot bug
+            for key in ('a', 'a', 'b', 'c'):
+                popular.mention(key, None)
+            self.assertFalse(popular.is_hot('c'))
+            popular.mention('c', None)
+            self.assertEqual(sorted(key for (key, tracker) in popular.hot_bugs()), ['a', 'c'])
+
+    def testTrackerIndex(self):
+        index = plugin.TrackerIndex()
+        project = plugin.Bugzilla('project', 'https://example.org/project', 'Project', 'bugzilla')
+        site = plugin.Bugzilla('site', 'https://example.org', 'Site', 'bugzilla')
+        index.add(site)
+        index.add(project)
+        self.assertIs(index.find('example.org/project/show_bug.cgi?id=1'), project)
+        self.assertIs(index.find('bugs.example.org/show_bug.cgi?id=1'), site)
+        self.assertIsNone(index.find('example.com/show_bug.cgi?id=1'))
+        index.remove(project)
+        self.assertIs(index.find('example.org/project/show_bug.cgi?id=1'), site)
+
+    def testAbbreviations(self):
+        names = ['debian', 'debbugs', 'deb', 'gnome', 'github', 'gitlab']
+        shorthand = plugin.Abbreviations(names)
+        self.assertEqual(shorthand['deb'], 'deb')
+        self.assertEqual(shorthand['debi'], 'debian')
+        self.assertEqual(shorthand['gn'], 'gnome')
+        for abbreviation in ('', 'de', 'g', 'git', 'x', 'debianx'):
+            self.assertRaises(KeyError, shorthand.__getitem__, abbreviation)
+        # The same as utils.abbrev() finds, as trackers come and go
+        for name in ('deb', 'gnome', 'gitlab'):
+            shorthand.remove(name)
+            names.remove(name)
+            expected = utils.abbrev(names)
+            for prefix in set(n[:i] for n in names for i in range(1, len(n) + 1)):
+                if prefix in expected:
+                    self.assertEqual(shorthand[prefix], expected[prefix])
+                else:
+                    self.assertRaises(KeyError, shorthand.__getitem__, prefix)
+        self.assertRaises(KeyError, shorthand.remove, 'gnome')
+        shorthand.add('gnome')
+        self.assertEqual(shorthand['gn'], 'gnome')
+
+    def testTrackerChanges(self):
+        def churn(n):
+            for i in range(200):
+                name = 'tracker%d' % ((n + i) % 5)
+                if i % 2:
+                    try:
+                        self.cb.remove_tracker(name)
+                    except KeyError:
+                        pass
+                else:
+                    self.cb.add_tracker(plugin.Bugzilla(name, 'https://%s.example.org' % name, name, 'bugzilla'))
+        threads = [threading.Thread(target=churn, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # The index and the abbreviations agree with the trackers left
+        for n in range(5):
+            name = 'tracker%d' % n
+            tracker = self.cb.db.get(name)
+            if tracker:
+                self.assertEqual(self.cb.shorthand[name], name)
+                self.assertIs(self.cb.index.find('%s.example.org/show_bug.cgi?id=1' % name), tracker)
+            else:
+                self.assertRaises(KeyError, self.cb.shorthand.__getitem__, name)
+                self.assertIsNone(self.cb.index.find('%s.example.org/show_bug.cgi?id=1' % name))
+
+    def testSnarferDispatch(self):
+        stub = self.stub({'/group/project/issues/5.json': lambda r: (200, {}, issue(5)),
+                          '/group/project/issues/6.json': lambda r: (200, {}, issue(6))})
+        self.tracker('lab', 'gitlab', stub.url + '/group/project/issues')
+        # Each snarfer gets the matches of its own pattern
+        self.assertSnarfRegexp('see %s/group/project/issues/5' % stub.url, 'Issue 5 in group/project "Title 5"')
+        self.assertSnarfRegexp('lab bug 6', 'Issue 6 in group/project "Title 6"')
+        self.assertSnarfRegexp('it broke with OOPS-1A2B3C4D', r'oops\.canonical\.com/\?oopsid=OOPS-1A2B3C4D')
+        # Overlapping matches go to the first snarfer, the URL one here
+        self.assertSnarfNoResponse('see %s/group/project/issues/5 again' % stub.url, timeout=0.5)
+        self.assertSnarfNoResponse('nothing to see here', timeout=0.5)
+        with conf.supybot.plugins.Bugtracker.bugSnarfer.context(False):
+            self.assertSnarfNoResponse('lab bug 7', timeout=0.5)
+
+    def testBugCommand(self):
+        def bugs(request):
+            ids = re.search(r'id=([\d,]+)', request.path).group(1).split(',')
+            return (200, {}, {'bugs': [{'id': int(id), 'product': 'Product', 'summary': 'Title %s' % id,
+                                        'severity': 'normal', 'status': 'NEW', 'resolution': '',
+                                        'assigned_to': 'nobody'} for id in ids if id != '2']})
+        running = [0, 0]
+        lock = threading.Lock()
+        def slow(request):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.2)
+            with lock:
+                running[0] -= 1
+            id = int(request.path.split('/')[-1].split('.')[0])
+            return (200, {}, issue(id))
+        routes = {'/rest/bug': bugs}
+        for id in range(1, 13):
+            routes['/group/project/issues/%d.json' % id] = slow
+        stub = self.stub(routes)
+        self.tracker('zilla', 'bugzilla', stub.url)
+        self.tracker('lab', 'gitlab', stub.url + '/group/project/issues')
+        # Ranges are looked up in a single request, and replied to in order
+        self.assertRegexp('bug zilla 3, 1-2, #5',
+                          r'"Title 3".* \| .*"Title 1".* \| Could not find .* bug 2 \| .*"Title 5"')
+        self.assertEqual(len(stub.requests), 1)
+        self.assertRegexp('bug zilla 3-1', 'not a bug number or range')
+        with conf.supybot.plugins.Bugtracker.maxBugs.context(3):
+            self.assertRegexp('bug zilla 1-4', 'At most 3 bugs can be looked up at once')
+        self.assertEqual(len(stub.requests), 1)
+        # Bugs of other trackers use half of the lookup threads
+        self.assertRegexp('bug lab 1-4', r'Issue 1 in .* \| Issue 4 in')
+        self.assertEqual(running[1], conf.supybot.plugins.Bugtracker.lookupThreads() // 2)
+        # What is not looked up by the deadline is given up on
+        requests = len(stub.requests)
+        with conf.supybot.plugins.Bugtracker.lookupTimeout.context(0.3):
+            self.assertRegexp('bug lab 7-12', r'Issue 7 in .* \| Issue 8 in .* \| '
+                                              r'Timed out getting .* bugs 9, 10, 11, 12')
+        # Bugs already being looked up still are, the others are cancelled
+        time.sleep(0.5)
+        self.assertEqual(len(stub.requests), requests + 4)
+
+    def testRateLimit(self):
+        reset = time.time() + 1
+        def bug(request):
+            id = int(request.path.split('/')[-1].split('.')[0])
+            return (200, {'X-RateLimit-Remaining': '10', 'X-RateLimit-Reset': '%.3f' % reset}, issue(id))
+        stub = self.stub({'/group/project/issues/%d.json' % id: bug for id in range(4, 9)})
+        tracker = self.tracker('lab', 'gitlab', stub.url + '/group/project/issues')
+        with conf.supybot.plugins.Bugtracker.rateLimitReserve.context(10), \
+             conf.supybot.plugins.Bugtracker.rateLimitWait.context(0.1), \
+             conf.supybot.plugins.Bugtracker.repeatdelay.context(0):
+            self.assertEqual(self.cb.fetch_bug(tracker, 4).title, 'Title 4')
+            # Snarfed bugs leave what remains of the budget to commands
+            self.assertSnarfRegexp('lab bug 5', 'Rate limit of 127.0.0.1:[0-9]+ exceeded')
+            self.assertRegexp('bug lab 6', 'Issue 6 in group/project "Title 6"')
+            self.assertEqual(len(stub.requests), 2)
+            # The snarfed bug is looked up once the budget is reset
+            for i in range(30):
+                schedule.run()
+                cached = self.cb.cache.get((tracker.url, 5))
+                if cached and cached[0]:
+                    break
+                time.sleep(0.1)
+            self.assertEqual(len(stub.requests), 3)
+            self.assertSnarfRegexp('lab bug 5', 'Issue 5 in group/project "Title 5"')
+        # Only bugs asked for wait for the budget to be reset
+        host = stub.url.split('://')[1]
+        with conf.supybot.plugins.Bugtracker.rateLimitWait.context(5):
+            plugin.ratelimits.get(host).until = time.time() + 0.5
+            start = time.time()
+            self.assertSnarfRegexp('lab bug 7', 'Rate limit of 127.0.0.1:[0-9]+ exceeded')
+            self.assertLess(time.time() - start, 0.5)
+            self.assertRegexp('bug lab 8', 'Issue 8 in group/project "Title 8"')
+            self.assertGreaterEqual(time.time() - start, 0.5)
+
+    def testRedirectAuth(self):
+        other = self.stub({'/9.json': lambda r: (200, {}, issue(9))})
+        stub = self.stub({'/group/project/issues/9.json': lambda r: (302, {'Location': other.url + '/9.json'}, b''),
+                          '/group/project/issues/10.json': lambda r: (302, {'Location': '/10.json'}, b''),
+                          '/10.json': lambda r: (200, {}, issue(10))})
+        tracker = self.tracker('lab', 'gitlab', stub.url + '/group/project/issues')
+        with conf.supybot.plugins.Bugtracker.apiTokens.context(['%s=secret' % stub.url.split('://')[1]]):
+            self.assertEqual(self.cb.fetch_bug(tracker, 9).title, 'Title 9')
+            self.assertEqual(self.cb.fetch_bug(tracker, 10).title, 'Title 10')
+        # The token is only sent to the host it is for
+        self.assertEqual([headers.get('PRIVATE-TOKEN') for (path, headers) in stub.requests], ['secret'] * 3)
+        self.assertIsNone(other.requests[0][1].get('PRIVATE-TOKEN'))
+
+    def testCoalescing(self):
+        def slow(status, body):
+            def answer(request):
+                time.sleep(0.5)
+                return (status, {}, body)
+            return answer
+        stub = self.stub({'/group/project/issues/5.json': slow(200, issue(5)),
+                          '/group/project/issues/7.json': slow(500, b'Internal error')})
+        tracker = self.tracker('lab', 'gitlab', stub.url + '/group/project/issues')
+        def lookup(bugid, results):
+            barrier.wait()
+            try:
+                results.append(self.cb.fetch_bug(tracker, bugid))
+            except plugin.BugtrackerError as e:
+                results.append(e)
+        for bugid in (5, 7):
+            barrier = threading.Barrier(5)
+            results = []
+            threads = [threading.Thread(target=lookup, args=(bugid, results)) for i in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(results), 5)
+            if bugid == 5:
+                # Concurrent lookups of a bug get what a single one found
+                self.assertEqual(results[0].title, 'Title 5')
+                self.assertTrue(all(bugdata is results[0] for bugdata in results))
+            else:
+                # Or each their own copy of its error
+                self.assertTrue(all(isinstance(e, plugin.BugtrackerError) for e in results))
+                self.assertEqual(len(set(map(id, results))), 5)
+        self.assertEqual([path for (path, headers) in stub.requests],
+                         ['/group/project/issues/5.json', '/group/project/issues/7.json'])
+        self.assertEqual(tracker.stats.counts['coalesced'], 8)
+
+    def testStats(self):
+        stub = self.stub({'/group/project/issues/5.json': lambda r: (200, {}, issue(5)),
+                          '/group/project/issues/7.json': lambda r: (500, {}, b'Internal error')})
+        tracker = self.tracker('lab', 'gitlab', stub.url + '/group/project/issues')
+        self.assertResponse('bugtracker stats', 'No bugs have been looked up yet.')
+        self.cb.fetch_bug(tracker, 5)
+        self.cb.fetch_bug(tracker, 5)
+        self.assertRaises(plugin.BugtrackerError, self.cb.fetch_bug, tracker, 7)
+        self.assertRegexp('bugtracker stats', r'^lab: 3 lookups \(1 cached, 0 stale, 0 coalesced\), 1 found, '
+                                              r'0 not found, 1 errors, 0 unavailable, 0 suppressed, '
+                                              r'fetch p50 \d+ms p95 \d+ms, parse p50 \d+ms p95 \d+ms$')
+        self.assertRegexp('bugtracker stats lab', '^lab: 3 lookups')
+        self.assertError('bugtracker stats nothing')
+        metrics = plugin.format_metrics([tracker]).splitlines()
+        for line in ('# TYPE bugtracker_lookups_total counter',
+                     'bugtracker_lookups_total{tracker="lab"} 3',
+                     'bugtracker_cache_hits_total{tracker="lab",state="fresh"} 1',
+                     'bugtracker_cache_hits_total{tracker="lab",state="stale"} 0',
+                     'bugtracker_results_total{tracker="lab",result="found"} 1',
+                     'bugtracker_results_total{tracker="lab",result="error"} 1',
+                     '# TYPE bugtracker_duration_seconds histogram',
+                     'bugtracker_duration_seconds_bucket{tracker="lab",phase="fetch",le="+Inf"} 2',
+                     'bugtracker_duration_seconds_count{tracker="lab",phase="fetch"} 2',
+                     'bugtracker_duration_seconds_count{tracker="lab",phase="parse"} 1',
+                     'bugtracker_duration_seconds_count{tracker="lab",phase="format"} 0',
+                     '# TYPE bugtracker_available gauge',
+                     'bugtracker_available{tracker="lab"} 1'):
+            self.assertIn(line, metrics)
+        # Buckets are cumulative, one per bound and +Inf
+        buckets = [int(line.split()[-1]) for line in metrics
+                   if line.startswith('bugtracker_duration_seconds_bucket{tracker="lab",phase="fetch",')]
+        self.assertEqual(len(buckets), len(plugin.Histogram.buckets) + 1)
+        self.assertEqual(buckets, sorted(buckets))
+        self.assertEqual(plugin._label('a "b"\\c\n'), 'a \\"b\\"\\\\c\\n')
+        # The same is written to the data directory
+        self.cb.write_metrics()
+        with open(conf.supybot.directories.data.dirize('Bugtracker-metrics.prom')) as fd:
+            self.assertEqual(fd.read().splitlines(), metrics)
+
+    def testTimeoutNotShown(self):
+        slow = [True]
+        def bug(request):
+            if slow[0]:
+                slow[0] = False
+                time.sleep(1)
+            return (200, {}, issue(5))
+        stub = self.stub({'/group/project/issues/5.json': bug})
+        self.tracker('lab', 'gitlab', stub.url + '/group/project/issues')
+        with conf.supybot.plugins.Bugtracker.lookupTimeout.context(0.2):
+            self.assertSnarfRegexp('lab bug 5', 'Timed out getting')
+        # Only bugs that were replied about count as shown
+        time.sleep(1)
+        self.assertSnarfRegexp('lab bug 5', 'Issue 5 in group/project "Title 5"')
+        self.assertSnarfNoResponse('lab bug 5', timeout=0.5)
+        # Unless they are asked for
+        self.assertRegexp('bug lab 5', 'Issue 5 in group/project "Title 5"')
+
+    def testETagRevalidation(self):
+        def bug(request):
+            if request.headers.get('If-None-Match') == '"v1"':
+                return (304, {'ETag': '"v1"'}, b'')
+            return (200, {'ETag': '"v1"', 'Content-Type': 'application/json'}, issue(5))
+        stub = self.stub({'/group/project/issues/5.json': bug})
+        tracker = self.tracker('lab', 'gitlab', stub.url + '/group/project/issues')
+        with conf.supybot.plugins.Bugtracker.cacheTTL.context(0):
+            first = self.cb.fetch_bug(tracker, 5)
+            second = self.cb.fetch_bug(tracker, 5)
+        self.assertEqual(first.title, 'Title 5')
+        self.assertEqual(second, first)
+        self.assertEqual(len(stub.requests), 2)
+        self.assertEqual(stub.requests[1][1].get('If-None-Match'), '"v1"')
+        # What is kept for revalidation is the parsed record, not the document
+        (etag, modified, record) = plugin.validators.get('%s/group/project/issues/5.json' % stub.url)
+        self.assertEqual(record, first)
+
+    def testBugzillaXML(self):
+        fields = '<short_desc>Crash in &quot;init&quot; &amp; caf&#233;</short_desc><bug_status>RESOLVED</bug_status>' \
+                 '<resolution>FIXED</resolution><product>Product</product><bug_severity>major</bug_severity>'
+        bugs = {'1': gzip.compress(('<?xml version="1.0"?><bugzilla><bug>%s<assigned_to name="Some One">'
+                                    'someone@example.org</assigned_to></bug></bugzilla>' % fields).encode('utf-8')),
+                '2': b'<?xml version="1.0"?><bugzilla><bug error="NotFound"><bug_id>2</bug_id></bug></bugzilla>',
+                # Comments that are sent anyway are not read, nor is this
+                # broken XML after them
+                '3': ('<?xml version="1.0"?><bugzilla><bug>%s<long_desc><thetext>%s</thetext>'
+                      % (fields, 'x' * 100000) + '<' * 100).encode('utf-8')}
+        def bug(request):
+            id = re.search(r'id=(\d+)', request.path).group(1)
+            return (200, {'Content-Encoding': 'gzip'} if id == '1' else {}, bugs[id])
+        stub = self.stub({'/show_bug.cgi': bug})
+        tracker = plugin.Bugzilla('zilla', stub.url, 'Bugzilla', 'bugzilla')
+        bugdata = tracker.get_bug_old(1)
+        self.assertEqual(bugdata.title, 'Crash in "init" & caf\xe9')
+        self.assertEqual((bugdata.product, bugdata.severity, bugdata.status, bugdata.assignee),
+                         ('Product', 'major', 'RESOLVED: FIXED', 'Some One'))
+        self.assertEqual(bugdata.url, '%s/show_bug.cgi?id=1' % stub.url)
+        self.assertIn('excludefield=long_desc', stub.requests[0][0])
+        self.assertRaises(plugin.BugNotFoundError, tracker.get_bug_old, 2)
+        bugdata = tracker.get_bug_old(3)
+        self.assertEqual((bugdata.title, bugdata.status, bugdata.assignee),
+                         ('Crash in "init" & caf\xe9', 'RESOLVED: FIXED', ''))
+
+    def testDebbugsBatch(self):
+        def item(id, package, subject, fixed):
+            return '<item><key xsi:type="xsd:int">%d</key><value><package>%s</package><subject>%s</subject>' \
+                   '<severity>normal</severity><fixed_versions soapenc:arrayType="xsd:anyType[%d]" ' \
+                   'xsi:type="soapenc:Array">%s</fixed_versions></value></item>' \
+                   % (id, package, subject, len(fixed), ''.join('<item>%s</item>' % v for v in fixed))
+        def soap(request):
+            ids = re.findall(r'<item xsi:type="xsd:int">(\d+)</item>', request.body.decode('utf-8'))
+            self.assertEqual(ids, ['3', '1', '2'])
+            body = '<?xml version="1.0" encoding="UTF-8"?><soap:Envelope ' \
+                   'xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/" ' \
+                   'xmlns:soapenc="http://schemas.xmlsoap.org/soap/encoding/" ' \
+                   'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" ' \
+                   'xmlns:xsd="http://www.w3.org/2001/XMLSchema"><soap:Body>' \
+                   '<get_statusResponse xmlns="urn:Debbugs/SOAP"><s-gensym3>%s%s</s-gensym3>' \
+                   '</get_statusResponse></soap:Body></soap:Envelope>' \
+                   % (item(1, 'one', 'First bug', []), item(3, 'three', 'Third bug', ['1.0-1']))
+            return (200, {'Content-Type': 'text/xml'}, body.encode('utf-8'))
+        stub = self.stub({'/cgi-bin/soap.cgi': soap})
+        tracker = plugin.Debbugs('debian', stub.url, 'Debian', 'debbugs')
+        bugs = tracker.get_bugs([3, 1, 2])
+        self.assertEqual(len(stub.requests), 1)
+        self.assertEqual((bugs[1].id, bugs[1].product, bugs[1].title, bugs[1].status), (1, 'one', 'First bug', 'Open'))
+        self.assertEqual((bugs[3].id, bugs[3].product, bugs[3].title, bugs[3].status), (3, 'three', 'Third bug', 'Fixed'))
+        self.assertEqual(bugs[3].url, '%s/3' % stub.url)
+        self.assertIsInstance(bugs[2], plugin.BugNotFoundError)
+
+    def testProxy(self):
+        url = 'http://forge.example/group/project/issues'
+        def bug(request):
+            headers = {'ETag': '"v1"', 'RateLimit-Remaining': '99', 'RateLimit-Reset': '60'}
+            if request.headers.get('If-None-Match') == '"v1"':
+                return (304, headers, b'')
+            return (200, headers, issue(5))
+        stub = self.stub({url + '/5.json': bug})
+        tracker = self.tracker('lab', 'gitlab', url)
+        with conf.supybot.protocols.http.proxy.context(stub.url.split('://')[1]), \
+             conf.supybot.plugins.Bugtracker.cacheTTL.context(0):
+            first = self.cb.fetch_bug(tracker, 5)
+            # Not modified is an answer through the proxy too
+            self.assertEqual(self.cb.fetch_bug(tracker, 5), first)
+            self.assertRaisesRegex(plugin.BugtrackerError, 'HTTP Error 404', self.cb.fetch_bug, tracker, 6)
+        self.assertEqual(first.title, 'Title 5')
+        self.assertEqual([path for (path, headers) in stub.requests], [url + '/5.json', url + '/5.json', url + '/6.json'])
+        self.assertEqual(stub.requests[1][1].get('If-None-Match'), '"v1"')
+        # And the rate limit headers are seen, the last request counted
+        # against them
+        self.assertEqual(plugin.ratelimits.get('forge.example').remaining, 98)
+
+    def testBreaker(self):
+        up = [False]
+        def bugs(request):
+            if not up[0]:
+                return (500, {}, b'Internal error')
+            return (200, {}, {'bugs': [{'id': 9, 'product': 'Product', 'summary': 'Title 9', 'severity': 'normal',
+                                        'status': 'NEW', 'resolution': '', 'assigned_to': 'nobody'}]})
+        stub = self.stub({'/rest/bug': bugs})
+        tracker = self.tracker('zilla', 'bugzilla', stub.url)
+        health = tracker.health
+        with conf.supybot.plugins.Bugtracker.breakerThreshold.context(2), \
+             conf.supybot.plugins.Bugtracker.cacheErrorTTL.context(0):
+            # A batched request that failed as a whole counts as a failure
+            self.assertRaises(plugin.BugtrackerError, self.cb.fetch_bugs, tracker, [1, 2])
+            self.assertEqual(health.state, health.CLOSED)
+            # So does one in which every bug failed
+            errors = lambda ids: dict((id, plugin.BugtrackerError('Error')) for id in ids)
+            health.call(tracker, errors, [3, 4])
+            self.assertEqual(health.state, health.OPEN)
+            # The tracker is not asked while the breaker is open
+            requests = len(stub.requests)
+            self.assertRaisesRegex(plugin.BugtrackerError, 'currently unavailable', self.cb.fetch_bugs, tracker, [5, 6])
+            self.assertEqual(len(stub.requests), requests)
+            # A single probe goes through after the cooldown, and a failed
+            # one opens the breaker again
+            health.opened -= conf.supybot.plugins.Bugtracker.breakerCooldown()
+            self.assertTrue(health.allow())
+            self.assertEqual(health.state, health.HALF_OPEN)
+            self.assertFalse(health.allow())
+            health.record(0.1, False)
+            self.assertEqual(health.state, health.OPEN)
+            # Being rate limited says nothing, and lets the next probe through
+            health.opened -= conf.supybot.plugins.Bugtracker.breakerCooldown()
+            def limited(id):
+                try:
+                    raise plugin.RateLimited('Rate limit exceeded')
+                except plugin.RateLimited as e:
+                    raise plugin.BugtrackerError(str(e))
+            other = plugin.IBugtracker('other', 'https://example.org', 'Other', 'other')
+            other.get_bug = limited
+            health.call(tracker, other.get_bugs, [7, 8])
+            self.assertEqual(health.state, health.HALF_OPEN)
+            self.assertTrue(health.allow())
+            health.release()
+            # A working probe closes it
+            health.opened -= conf.supybot.plugins.Bugtracker.breakerCooldown()
+            up[0] = True
+            bugs = self.cb.fetch_bugs(tracker, [9, 10])
+            self.assertEqual(bugs[9].title, 'Title 9')
+            self.assertIsInstance(bugs[10], plugin.BugNotFoundError)
+            self.assertEqual(health.state, health.CLOSED)
+
+    def testForgeProbe(self):
+        stub = self.stub({'/api.json': lambda r: (200, {}, issue(1)),
+                          '/page.html': lambda r: (200, {}, b'<html></html>'),
+                          '/error.json': lambda r: (502, {}, b'Bad gateway'),
+                          '/private.json': lambda r: (401, {}, {'message': '401 Unauthorized'})})
+        tracker = plugin.GitLab()
+        self.assertTrue(tracker.probe_json(stub.url + '/api.json'))
+        self.assertFalse(tracker.probe_json(stub.url + '/page.html'))
+        self.assertFalse(tracker.probe_json(stub.url + '/missing.json'))
+        self.assertTrue(tracker.probe_json(stub.url + '/private.json'))
+        self.assertRaises(plugin.BugtrackerError, tracker.probe_json, stub.url + '/error.json')
+        # A host that could not be probed is only skipped for a short while
+        now = time.time()
+        self.assertIsNone(self.cb.get_forge_tracker('127.0.0.1:1/group/project/issues/5', 5))
+        self.assertEqual(self.cb.forges.get('127.0.0.1:1'), '')
+        self.assertLessEqual(self.cb.forges.failed['127.0.0.1:1'],
+                             time.time() + conf.supybot.plugins.Bugtracker.probeErrorTTL())
+        self.assertGreater(self.cb.forges.failed['127.0.0.1:1'], now)
+        # Lookups of a host being probed wait for that probe
+        (future, leader) = self.cb.probes.claim('forge.example.org')
+        trackers = []
+        thread = threading.Thread(target=lambda: trackers.append(
+            self.cb.get_forge_tracker('forge.example.org/group/project/issues/5', 5)))
+        self.cb.probe_forge = lambda *args: self.fail('Probed again')
+        thread.start()
+        time.sleep(0.2)
+        self.cb.probes.finish('forge.example.org', 'gitea')
+        thread.join(5)
+        self.assertIsInstance(trackers[0], plugin.Gitea)
+        self.assertEqual(trackers[0].url, 'https://forge.example.org/group/project/issues')
+
+    def testForgeProbeMissingIssue(self):
+        stub = self.stub({'/api/v4/version': lambda r: (401, {}, {'message': '401 Unauthorized'}),
+                          '/group/project/issues/5.json': lambda r: (404, {}, {'message': '404 Not found'}),
+                          '/group/project/issues/6.json': lambda r: (200, {}, issue(6))})
+        host = stub.url.split('://')[1]
+        request_url = plugin.request_url
+        plugin.request_url = lambda url, *args: request_url(url.replace('https://', 'http://'), *args)
+        try:
+            # A missing issue says nothing about the host
+            self.assertSnarfRegexp('see %s/group/project/issues/5' % stub.url, 'issues/5')
+            self.assertEqual(self.cb.forges.get(host), 'gitlab')
+            self.assertSnarfRegexp('see %s/group/project/issues/6' % stub.url, 'Issue 6 in group/project "Title 6"')
+        finally:
+            plugin.request_url = request_url
+
+    def testUserCache(self):
+        prefix = 'someone!someone@example.org'
+        resolve = lambda: usercache.resolve(ircmsgs.privmsg(self.channel, 'hello', prefix=prefix))
+        self.assertEqual(resolve(), (None, False))
+        user = ircdb.users.newUser()
+        user.name = 'someone'
+        user.addHostmask('someone!*@example.org')
+        ircdb.users.setUser(user)
+        try:
+            # Who a hostmask belongs to is remembered for a while
+            self.assertEqual(resolve(), (None, False))
+            usercache.cache.clear()
+            self.assertEqual(resolve(), (user, False))
+            ircdb.ignores.add('someone!*@*')
+            usercache.cache.clear()
+            self.assertEqual(resolve(), (user, True))
+            ircdb.ignores.remove('someone!*@*')
+            usercache.cache.clear()
+            self.assertEqual(resolve(), (user, False))
+            # Channel ignores are not checked while testing, lobotomies are
+            channel = ircdb.channels.getChannel(self.channel)
+            channel.lobotomized = True
+            ircdb.channels.setChannel(self.channel, channel)
+            usercache.cache.clear()
+            self.assertEqual(resolve(), (user, True))
+            channel.lobotomized = False
+            ircdb.channels.setChannel(self.channel, channel)
+        finally:
+            ircdb.users.delUser(user.id)
+            usercache.cache.clear()
+        self.assertEqual(resolve(), (None, False))
+        # ircdb itself is left alone
+        self.assertFalse(hasattr(ircdb.UsersDictionary.setUser, '__wrapped__'))
+
+    def testExpiryDict(self):
+        d = expiry.ExpiryDict()
+        d.set('short', 1, 0.05)
+        d.set('long', 2, 60)
+        self.assertTrue(d.add('new', 3, 60))
+        self.assertFalse(d.add('new', 4, 60))
+        self.assertEqual(d.get('new'), 3)
+        self.assertEqual(sorted(d.keys()), ['long', 'new', 'short'])
+        # Setting a key again replaces its expiry time along with its value
+        d.set('long', 5, 0.05)
+        d.set('short', 6, 60)
+        time.sleep(0.1)
+        self.assertEqual(d.get('short'), 6)
+        self.assertNotIn('long', d)
+        self.assertIsNone(d.get('long'))
+        self.assertEqual(d.get('long', 7), 7)
+        self.assertEqual(len(d), 2)
+        self.assertTrue(d.add('long', 8, 60))
+
+    def testCVEImport(self):
+        feed = {'CVE_Items': [
+            {'cve': {'CVE_data_meta': {'ID': 'CVE-2020-1234'},
+                     'description': {'description_data': [{'lang': 'en', 'value': 'Old description'}]}},
+             'lastModifiedDate': '2020-01-01T00:00Z'},
+            {'cve': {'CVE_data_meta': {'ID': 'CVE-2020-5678'},
+                     'description': {'description_data': [{'lang': 'en', 'value': 'Other description'}]}},
+             'lastModifiedDate': '2020-01-01T00:00Z'}]}
+        delta = {'cveMetadata': {'cveId': 'CVE-2020-1234', 'state': 'PUBLISHED', 'dateUpdated': '2021-01-01T00:00Z'},
+                 'containers': {'cna': {'descriptions': [{'lang': 'en', 'value': 'New description'}]}}}
+        with tempfile.TemporaryDirectory() as path:
+            with open(os.path.join(path, 'feed.json'), 'w') as fd:
+                json.dump(feed, fd)
+            os.mkdir(os.path.join(path, 'delta'))
+            with open(os.path.join(path, 'delta', 'CVE-2020-1234.json'), 'w') as fd:
+                json.dump(delta, fd)
+            self.assertError('cveimport %s' % path)
+            with conf.supybot.plugins.Bugtracker.cveDatabase.context(True), \
+                 conf.supybot.plugins.Bugtracker.cveSnarfer.context(True):
+                self.assertRegexp('cveimport %s' % os.path.join(path, 'delta'), '1 CVE records read')
+                # The older record from the full feed does not replace the delta
+                self.assertRegexp('cveimport %s' % path, '3 CVE records read')
+                self.assertSnarfRegexp('about CVE-2020-1234', '^New description <https://')
+                self.assertSnarfRegexp('and CVE 2020-5678', '^Other description <https://')
+
+# vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
@@ -20,21 +20,24 @@ import supybot.ircutils as ircutils
 import supybot.ircmsgs as ircmsgs
 import supybot.callbacks as callbacks
 import supybot.ircutils as ircutils
-import supybot.ircdb as ircdb
 import supybot.conf as conf
 import os
 import re
+import sys
 import time
-from . import packages
 from imp import reload
+# Modules shared by several plugins are kept in a package next to them
+plugins_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if plugins_dir not in sys.path:
+    sys.path.append(plugins_dir)
+from ubottu_common import expiry, usercache
+from . import packages
 reload(packages)
+reload(expiry)
+reload(usercache)
 
 def get_user(msg):
-    try:
-        user = ircdb.users.getUser(msg.prefix)
-    except:
-        return False
-    return user
+    return usercache.resolve(msg)[0] or False
 
 _stripNickChars = """!"#$%&'()*+,./:;<=>?@~"""
 def stripNick(nick):
@@ -44,22 +47,18 @@ def stripNick(nick):
 
 ## Taken from Encyclopedia ##
 # Repeat filtering message queue
-msgcache = {}
+msgcache = expiry.ExpiryDict() # (irc, to): [(expires, msg), ...]
 def queue(irc, to, msg):
     now = time.time()
-    for m in list(msgcache.keys()):
-        if msgcache[m] < now - 30:
-            msgcache.pop(m)
-    for m in msgcache:
-        if m[0] == irc and m[1] == to:
-            oldmsg = m[2]
-            if msg == oldmsg or oldmsg.endswith(msg):
-                break
-            if msg.endswith(oldmsg):
-                msg = msg[:-len(oldmsg)] + 'please see above'
-    else:
-        msgcache[(irc, to, msg)] = now
-        irc.queueMsg(ircmsgs.privmsg(to, msg))
+    recent = [(expires, oldmsg) for (expires, oldmsg) in msgcache.get((irc, to), []) if expires > now]
+    for (expires, oldmsg) in recent:
+        if msg == oldmsg or oldmsg.endswith(msg):
+            return
+        if msg.endswith(oldmsg):
+            msg = msg[:-len(oldmsg)] + 'please see above'
+    recent.append((now + 30, msg))
+    msgcache.set((irc, to), recent, 30)
+    irc.queueMsg(ircmsgs.privmsg(to, msg))
 
 class PackageInfo(callbacks.Plugin):
     """Lookup package information via apt-cache/apt-file"""
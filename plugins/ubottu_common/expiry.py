@@ -0,0 +1,83 @@
+# -*- Encoding: utf-8 -*-
+###
+# Copyright (c) 2005-2007 Dennis Kaarsemaker
+# Copyright (c) 2008-2010 Terence Simpson
+# Copyright (c) 2017-     Krytarik Raido
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of version 2 of the GNU General Public License as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+###
+
+import time, heapq, itertools, threading
+
+class ExpiryDict:
+    """A dict whose entries expire after their own TTL. Expiry times are
+    kept in a heap, so expiring entries never looks at live ones."""
+    def __init__(self):
+        self.data    = {} # key: (expires, serial, value)
+        self.heap    = [] # (expires, serial, key)
+        self.serials = itertools.count()
+        self.lock    = threading.Lock()
+
+    def _expire(self, now):
+        while self.heap and self.heap[0][0] <= now:
+            (expires, serial, key) = heapq.heappop(self.heap)
+            # Skip heap entries left behind by a later set() of the same key
+            if key in self.data and self.data[key][1] == serial:
+                del self.data[key]
+
+    def _set(self, key, value, ttl, now):
+        serial = next(self.serials)
+        self.data[key] = (now + ttl, serial, value)
+        heapq.heappush(self.heap, (now + ttl, serial, key))
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self.lock:
+            self._expire(now)
+            self._set(key, value, ttl, now)
+
+    def add(self, key, value, ttl):
+        """Set key unless it is already there. Returns whether it was set."""
+        now = time.time()
+        with self.lock:
+            self._expire(now)
+            if key in self.data:
+                return False
+            self._set(key, value, ttl, now)
+            return True
+
+    def get(self, key, default=None):
+        with self.lock:
+            self._expire(time.time())
+            try:
+                return self.data[key][2]
+            except KeyError:
+                return default
+
+    def clear(self):
+        with self.lock:
+            self.data = {}
+            self.heap = []
+
+    def keys(self):
+        with self.lock:
+            self._expire(time.time())
+            return list(self.data.keys())
+
+    def __contains__(self, key):
+        with self.lock:
+            self._expire(time.time())
+            return key in self.data
+
+    def __len__(self):
+        with self.lock:
+            self._expire(time.time())
+            return len(self.data)
@@ -0,0 +1,63 @@
+# -*- Encoding: utf-8 -*-
+###
+# Copyright (c) 2005-2007 Dennis Kaarsemaker
+# Copyright (c) 2008-2010 Terence Simpson
+# Copyright (c) 2017-     Krytarik Raido
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of version 2 of the GNU General Public License as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+###
+
+import supybot.ircdb as ircdb
+import supybot.ircutils as ircutils
+from . import expiry
+
+# Seconds to remember who a hostmask belongs to. Changes to users, ignores
+# and channels take at most this long to be seen.
+ttl = 10
+
+cache = expiry.ExpiryDict() # (hostmask, channel): (user, ignored)
+
+def _resolve(hostmask, recipient):
+    try:
+        user = ircdb.users.getUser(hostmask)
+    except (KeyError, ircdb.DuplicateHostmask):
+        user = None
+    if user and user._checkCapability('owner'):
+        ignored = False
+    elif user and user.ignore:
+        ignored = True
+    elif ircdb.ignores.checkIgnored(hostmask):
+        ignored = True
+    elif ircutils.isChannel(recipient):
+        ignored = ircdb.channels.getChannel(recipient).checkIgnored(hostmask)
+    else:
+        ignored = False
+    return (user, ignored)
+
+def resolve(msg):
+    """Return (user, ignored) for the sender of msg: the registered user the
+    hostmask belongs to, or None, and whether the bot ignores them where the
+    message was sent. Matching hostmasks against all users is done at most
+    once per message, however many plugins ask, and its result is reused
+    for later messages from the same hostmask for a few seconds."""
+    resolved = msg.tagged('sender')
+    if resolved:
+        return resolved
+    if not msg.prefix:
+        return (None, False)
+    recipient = msg.args[0]
+    key = (msg.prefix, recipient.lower() if ircutils.isChannel(recipient) else None)
+    resolved = cache.get(key)
+    if not resolved:
+        resolved = _resolve(msg.prefix, recipient)
+        cache.set(key, resolved, ttl)
+    msg.tag('sender', resolved)
+    return resolved